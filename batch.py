@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+Run receipt analyses for many images in a pool of worker processes
+
+@author: phdenzel
+
+"""
+import multiprocessing
+import metrics
+import layout
+from receipt import Receipt
+from workspace import Workspace
+from index import FileIndex
+from cache import ArtifactCache, digest, file_digest
+
+# per-process settings, set up by init_worker
+_options = {}
+
+
+def init_worker(auto=False, preprocessing='imagemagick', ocr='cli',
+                index=None, debug=0, retry=None):
+    """
+    Set up a worker process
+
+    Args:
+       None
+
+    Kwargs:
+       auto: bool; run scripts to scan and ocr the receipts
+       preprocessing: str; either 'imagemagick' or 'native'
+       ocr: str; either 'cli', 'api', or 'roi'
+       index: FileIndex; index of the images and artifacts of the batch
+       debug: int; scanner debug level of the saved intermediate products
+       retry: float; threshold below which the OCR is retried on other
+              preprocessing variants, None to not retry
+
+    Return:
+       None
+    """
+    _options.clear()
+    _options.update(auto=auto, preprocessing=preprocessing, ocr=ocr,
+                    index=index, debug=debug, retry=retry)
+
+
+def analyze(file_id):
+    """
+    Scan, preprocess, OCR, and parse a single receipt in its own workspace
+
+    Args:
+       file_id: str; the file ID of the receipt's image
+
+    Kwargs:
+       None
+
+    Return:
+       fields: dict; the receipt's file_id, market, total, date, time,
+               and its 'metrics' (see metrics.Metrics.as_dict)
+    """
+    m = metrics.begin()
+    with m.stage('total'):
+        receipt = Receipt(file_id,
+                          workspace=Workspace(file_id),
+                          **_options)
+        fields = receipt.fields()
+        fields['input'] = receipt.source.digest
+        receipt.close()
+    fields['metrics'] = m.as_dict()
+    return fields
+
+
+def reparse(item):
+    """
+    Parse a receipt from its OCR text file only
+
+    Args:
+       item: tuple(str); file ID, path string to the OCR text file, and
+             hash of the receipt's image or None, see archive
+
+    Kwargs:
+       None
+
+    Return:
+       fields: dict; the receipt's file_id, market, total, date, time,
+               and its 'metrics' (see metrics.Metrics.as_dict); 'input'
+               is the image's hash, None if it is unknown
+    """
+    file_id, path, input_hash = item
+    m = metrics.begin()
+    with m.stage('total'):
+        with m.stage('read'), open(path) as f:
+            lines = f.readlines()
+        fields = Receipt.from_text(file_id, lines).fields()
+        fields['input'] = input_hash
+    fields['metrics'] = m.as_dict()
+    return fields
+
+
+def run_params(parse_only=False, **options):
+    """
+    Digest of everything besides the input file which determines a
+    receipt's results, for the progress journal
+
+    Args:
+       None
+
+    Kwargs:
+       parse_only: bool; only the OCR texts are re-analyzed
+       options: the options of run_batch, e.g. preprocessing='native'
+
+    Return:
+       params: str; hex digest of the run parameters
+    """
+    parts = [file_digest(layout.config), parse_only]
+    if not parse_only:
+        import scanner
+        import preprocess
+        import ocr
+        parts += [sorted(options.items()), scanner.SETTINGS,
+                  preprocess.METHODS, ocr.ENGINES]
+    return digest(*parts)
+
+
+def archive(index=None, cache=None):
+    """
+    OCR text files of all receipts, from the cache manifest and the legacy
+    prp/ and txt/ file names
+
+    Args:
+       None
+
+    Kwargs:
+       index: FileIndex; index of the legacy artifacts
+       cache: ArtifactCache; cache of the OCR texts (takes precedence)
+
+    Return:
+       items: list(tuple); file ID, path string to the OCR text file, and
+              hash of the image it was read from (of the image in imgs/
+              for legacy texts, None if it is gone), sorted by file ID
+    """
+    cache = cache or ArtifactCache.default()
+    index = index or FileIndex()
+    texts = index.texts()
+    texts.update(cache.artifacts('txt'))
+    inputs = cache.inputs('txt')
+    items = []
+    for file_id, path in sorted(texts.items()):
+        input_hash = inputs.get(file_id)
+        image = index.image(file_id)
+        if input_hash is None and image is not None:
+            # legacy texts were not recorded with their image's hash
+            input_hash = file_digest(index.imgd+image)
+        items.append((file_id, path, input_hash))
+    return items
+
+
+def pool_map(func, items, jobs=1, initializer=None, initargs=(),
+             chunksize=1):
+    """
+    Lazily map a function over items in a pool of worker processes
+
+    Args:
+       func: callable; a module-level function
+       items: list; arguments of func
+
+    Kwargs:
+       jobs: int; number of worker processes, 1 runs everything in-process
+       initializer: callable; set up of each worker process
+       initargs: tuple; arguments of initializer
+       chunksize: int; number of items sent to a worker at once
+
+    Return:
+       results: generator; results of func in input order, as they finish
+    """
+    if jobs <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for i in items:
+            yield func(i)
+        return
+    pool = multiprocessing.Pool(jobs, initializer=initializer,
+                                initargs=initargs)
+    try:
+        for result in pool.imap(func, items, chunksize):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def run_batch(file_ids, jobs=1, auto=False, preprocessing='imagemagick',
+              ocr='cli', index=None, debug=0, retry=None):
+    """
+    Analyze receipts in a pool of worker processes
+
+    Args:
+       file_ids: list(str); file IDs of the receipts' images
+
+    Kwargs:
+       jobs: int; number of worker processes, 1 runs everything in-process
+       auto: bool; run scripts to scan and ocr the receipts
+       preprocessing: str; either 'imagemagick' or 'native'
+       ocr: str; either 'cli', 'api', or 'roi'
+       index: FileIndex; index of the images and artifacts, built once for
+              the batch if not given
+       debug: int; scanner debug level of the saved intermediate products
+       retry: float; threshold below which the OCR is retried on other
+              preprocessing variants, None to not retry
+
+    Return:
+       results: generator(dict); fields of each receipt in input order
+    """
+    if index is None:
+        index = FileIndex()
+    return pool_map(analyze, file_ids, jobs=jobs, initializer=init_worker,
+                    initargs=(auto, preprocessing, ocr, index, debug, retry))
+
+
+def run_reparse(items, jobs=1):
+    """
+    Re-analyze OCR text files without any image stages
+
+    Args:
+       items: list(tuple); file IDs, paths to the OCR text files, and
+              image hashes, e.g. from archive()
+
+    Kwargs:
+       jobs: int; number of worker processes, 1 runs everything in-process
+
+    Return:
+       results: generator(dict); fields of each receipt in input order
+    """
+    return pool_map(reparse, items, jobs=jobs, chunksize=64)
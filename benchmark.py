@@ -0,0 +1,523 @@
+#!/usr/bin/env python
+"""
+Benchmark pentaplex's pipeline stages on synthetic receipts with known
+market, date, time, and total
+
+@author: phdenzel
+
+"""
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+from shutil import rmtree, copy
+try:
+    from shutil import which
+except ImportError:  # Python 2
+    from distutils.spawn import find_executable as which
+import numpy as np
+import cv2
+import scanner
+import preprocess
+import ocr
+import layout
+from mkpath import mkdir_p
+from receipt import Receipt
+from config import Config
+from cache import ArtifactCache
+from index import FileIndex
+from batch import run_batch
+from pipeline import run_pipeline, parse_workers
+from metrics import cpu_time
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+ITEMS = ["brot", "milch", "butter", "kaese", "aepfel", "tomaten", "kaffee",
+         "reis", "teigwaren", "joghurt", "eier", "wasser", "schokolade"]
+
+
+def spellings(configs):
+    """
+    Markets with a spelling which is unique to them, such that the
+    expected market of a synthetic receipt is unambiguous
+
+    Args:
+       configs: Config instance; the fuzzy finding configurations
+
+    Kwargs:
+       None
+
+    Return:
+       spellings: list(tuple); (market, spelling) pairs
+    """
+    owners = {}
+    for spelling, market in configs.spellings:
+        owners.setdefault(spelling, set()).add(market)
+    found = []
+    for market, names in configs.markets.items():
+        for spelling in names:
+            if owners[spelling] == set([market]):
+                found.append((market, spelling))
+                break
+    return found
+
+
+def ground_truth(rng, configs):
+    """
+    Random receipt content
+
+    Args:
+       rng: random.Random instance; the random number generator
+       configs: Config instance; the fuzzy finding configurations
+
+    Kwargs:
+       None
+
+    Return:
+       truth: dict; market, date, time, total, and the receipt's text lines
+    """
+    market, spelling = rng.choice(spellings(configs))
+    items = [(rng.choice(ITEMS), rng.randint(50, 2500))
+             for _ in range(rng.randint(3, 15))]
+    cents = sum(p for _, p in items)
+    total = "{}.{:02d}".format(cents // 100, cents % 100)
+    date = "{:02d}.{:02d}.{}".format(rng.randint(1, 28), rng.randint(1, 12),
+                                     rng.randint(2010, 2020))
+    clock = "{:02d}:{:02d}".format(rng.randint(7, 21), rng.randint(0, 59))
+    lines = [spelling.upper(), "bahnhofstrasse {}".format(rng.randint(1, 99)),
+             "8001 zuerich", ""]
+    for name, price in items:
+        lines.append("{:<18}{:>7}".format(
+            name, "{}.{:02d}".format(price // 100, price % 100)))
+    lines += ["", "{:<14}{:>11}".format("summe chf", total),
+              "{:<14}{:>11}".format("bar", total), "",
+              "datum {}  zeit {}".format(date, clock)]
+    return {'market': market, 'total': total, 'date': date, 'time': clock,
+            'lines': lines}
+
+
+def render(lines, width=576, line_height=34, margin=24):
+    """
+    Render text lines onto a white paper strip
+
+    Args:
+       lines: list(str); the receipt's text lines
+
+    Kwargs:
+       width: int; width of the paper in pixels
+       line_height: int; height of a text line in pixels
+       margin: int; margin around the text in pixels
+
+    Return:
+       paper: np.ndarray; BGR image of the receipt
+    """
+    height = 2*margin + line_height*len(lines)
+    paper = np.full((height, width, 3), 250, dtype=np.uint8)
+    for i, line in enumerate(lines):
+        y = margin + line_height*(i+1) - line_height//4
+        cv2.putText(paper, line, (margin, y), FONT, 0.75, (20, 20, 20), 2,
+                    cv2.LINE_AA)
+    return paper
+
+
+def synthesize(rng, configs, size=(2000, 1500), distortion=0.06, angle=8.,
+               noise=6.):
+    """
+    Synthetic photo of a receipt: rendered text, perspective distorted and
+    rotated onto a noisy background
+
+    Args:
+       rng: random.Random instance; the random number generator
+       configs: Config instance; the fuzzy finding configurations
+
+    Kwargs:
+       size: tuple(int); height and width of the photo
+       distortion: float; corner jitter as fraction of the receipt's size
+       angle: float; largest rotation in degrees
+       noise: float; standard deviation of the pixel noise
+
+    Return:
+       photo: np.ndarray; BGR image of the photo
+       truth: dict; ground truth incl. the receipt's 'corners' in the photo
+    """
+    truth = ground_truth(rng, configs)
+    paper = render(truth['lines'])
+    ph, pw = paper.shape[:2]
+    h, w = size
+    nprng = np.random.RandomState(rng.randint(0, 2**31-1))
+    # textured dark background
+    background = nprng.normal(70, 25, (h//8, w//8, 3)).clip(0, 255)
+    background = cv2.resize(background.astype(np.uint8), (w, h),
+                            interpolation=cv2.INTER_CUBIC)
+    # place the receipt at 80% of the photo's height
+    scale = min(0.8*h/ph, 0.8*w/pw)
+    rw, rh = scale*pw, scale*ph
+    center = np.array([w/2., h/2.])
+    corners = np.array([[-rw/2, -rh/2], [rw/2, -rh/2], [rw/2, rh/2],
+                        [-rw/2, rh/2]])
+    theta = np.radians(rng.uniform(-angle, angle))
+    rot = np.array([[np.cos(theta), -np.sin(theta)],
+                    [np.sin(theta), np.cos(theta)]])
+    jitter = nprng.uniform(-distortion, distortion, (4, 2))*[rw, rh]
+    corners = (corners+jitter).dot(rot.T) + center
+    src = np.float32([[0, 0], [pw, 0], [pw, ph], [0, ph]])
+    M = cv2.getPerspectiveTransform(src, corners.astype(np.float32))
+    warped = cv2.warpPerspective(paper, M, (w, h))
+    mask = cv2.warpPerspective(np.full((ph, pw), 255, np.uint8), M, (w, h))
+    photo = np.where(mask[..., None] > 0, warped, background)
+    photo = photo + nprng.normal(0, noise, photo.shape)
+    truth['corners'] = corners.tolist()
+    return photo.clip(0, 255).astype(np.uint8), truth
+
+
+class Timings(object):
+    """
+    Wall and CPU durations of named stages
+    """
+
+    def __init__(self):
+        self.wall = {}
+        self.cpu = {}
+
+    def add(self, stage, wall, cpu):
+        self.wall.setdefault(stage, []).append(wall)
+        self.cpu.setdefault(stage, []).append(cpu)
+
+    def time(self, stage, func, *args, **kwargs):
+        """
+        Run a function and record its durations
+
+        Args:
+           stage: str; name of the stage
+           func: callable; the timed function
+
+        Kwargs:
+           args, kwargs: arguments of func
+
+        Return:
+           result: return value of func
+        """
+        w0, c0 = time.time(), cpu_time()
+        result = func(*args, **kwargs)
+        self.add(stage, time.time()-w0, cpu_time()-c0)
+        return result
+
+    def summary(self):
+        """
+        Statistics of every stage in milliseconds
+
+        Args/Kwargs:
+           None
+
+        Return:
+           summary: dict; n, mean, median, p95 of wall time and mean CPU time
+        """
+        stats = {}
+        for stage, walls in self.wall.items():
+            ms = np.array(walls)*1e3
+            stats[stage] = {
+                'n': len(walls),
+                'mean': float(ms.mean()),
+                'median': float(np.median(ms)),
+                'p95': float(np.percentile(ms, 95)),
+                'cpu': float(np.mean(self.cpu[stage])*1e3),
+            }
+        return stats
+
+
+def ocr_backend():
+    """
+    Best available OCR backend
+
+    Return:
+       backend: str; 'api', 'cli', or None if tesseract is not available
+    """
+    if ocr.tesserocr is not None:
+        return 'api'
+    if which('tesseract'):
+        return 'cli'
+    return None
+
+
+def recognize(prepd, backend, tmpdir):
+    """
+    Recognize the text of a preprocessed scan
+
+    Args:
+       prepd: np.ndarray; the preprocessed scan
+       backend: str; either 'api' or 'cli'
+       tmpdir: str; scratch directory for the 'cli' backend
+
+    Kwargs:
+       None
+
+    Return:
+       lines: list(str); the recognized text lines
+    """
+    if backend == 'api':
+        return ocr.TesseractEngine.shared().recognize(prepd)
+    png = os.path.join(tmpdir, "{}.png".format(os.getpid()))
+    cv2.imwrite(png, prepd)
+    txt = ocr.tesseract(png, png[:-4]+".txt")
+    with open(txt) as f:
+        return f.readlines()
+
+
+def compare(fields, truth):
+    """
+    Correctness of the extracted fields
+
+    Args:
+       fields: dict; output of Receipt.fields
+       truth: dict; the ground truth
+
+    Kwargs:
+       None
+
+    Return:
+       correct: dict; bool for each of market, date, time, and total
+    """
+    total = (fields.get('total') or '').replace(',', '.').replace(' ', '')
+    return {
+        'market': fields.get('market') == truth['market'],
+        'date': fields.get('date') == truth['date'],
+        'time': fields.get('time') == truth['time'],
+        'total': total == truth['total'],
+    }
+
+
+def corner_error(report, truth):
+    """
+    Mean distance between the detected and the true corners in pixels
+    """
+    found = np.array(report['corners'])
+    true = np.array(truth['corners'])
+    return float(np.linalg.norm(found-true, axis=1).mean())
+
+
+def write_photos(photos, count):
+    """
+    Write the synthetic photos (cycled) as JPEGs into imgs/; each copy's
+    number is coded as black and white squares in its corner, such that
+    it is a distinct input of the content-addressed cache
+
+    Args:
+       photos: list(np.ndarray); the synthetic photos
+       count: int; number of images
+
+    Kwargs:
+       None
+
+    Return:
+       file_ids: list(str); file IDs of the images
+    """
+    mkdir_p(layout.imgd)
+    file_ids = []
+    for i in range(count):
+        photo = photos[i % len(photos)].copy()
+        for bit in range(16):
+            photo[:16, 16*bit:16*(bit+1)] = 255 if i >> bit & 1 else 0
+        file_id = "{:07d}".format(i)
+        cv2.imwrite("{}IMG_{}.jpg".format(layout.imgd, file_id), photo)
+        file_ids.append(file_id)
+    return file_ids
+
+
+def clear_cache():
+    """
+    Remove all cached artifacts and workspaces, such that the next run
+    analyzes every receipt from scratch
+    """
+    for d in (layout.prpd, layout.txtd, layout.tmpd):
+        rmtree(d, ignore_errors=True)
+    ArtifactCache._default = None
+
+
+def bench_stages(photos, truths, backend, tmpdir, imagemagick=False):
+    """
+    Time every pipeline stage separately on each photo
+
+    Args:
+       photos: list(np.ndarray); the synthetic photos
+       truths: list(dict); their ground truths
+       backend: str; OCR backend, None skips OCR
+       tmpdir: str; scratch directory
+
+    Kwargs:
+       imagemagick: bool; also time ImageMagick's preprocessing
+
+    Return:
+       timings: Timings instance
+       accuracy: dict; lists of correctness and corner errors
+    """
+    t = Timings()
+    accuracy = {'corners': [], 'strategy': [], 'parse': [], 'ocr': []}
+    for i, (photo, truth) in enumerate(zip(photos, truths)):
+        report = {}
+        dst = t.time('scan', scanner.scan, photo, verbose=False,
+                     report=report)
+        t.add('scan.detect', *report['detect'])
+        t.add('scan.find_quad', report['seconds'], report['cpu'])
+        t.add('scan.warp', *report['warp'])
+        accuracy['corners'].append(corner_error(report, truth))
+        accuracy['strategy'].append(report['strategy'])
+        prepd = t.time('preprocess.native', preprocess.native, dst)
+        if imagemagick:
+            src = os.path.join(tmpdir, "dst.jpg")
+            cv2.imwrite(src, dst)
+            t.time('preprocess.imagemagick', preprocess.imagemagick, src,
+                   os.path.join(tmpdir, "prepd.png"))
+        # parsing of the true text isolates the parser's accuracy
+        r = t.time('parse.from_text', Receipt.from_text, str(i),
+                   truth['lines'])
+        accuracy['parse'].append(compare(r.fields(), truth))
+        r._matches = None
+        t.time('parse.match', lambda: r.matches)
+        for field in ('total', 'market', 'date', 'time'):
+            t.time('parse_'+field, getattr(r, 'parse_'+field), None)
+        if backend:
+            lines = t.time('ocr.'+backend, recognize, prepd, backend, tmpdir)
+            fields = Receipt.from_text(str(i), lines).fields()
+            accuracy['ocr'].append(compare(fields, truth))
+    return t, accuracy
+
+
+def bench_throughput(photos, sizes, jobs, backend):
+    """
+    End-to-end throughput of the staged pipeline and of the batch driver
+    at several batch sizes, on JPEGs in imgs/ and with an empty cache
+
+    Args:
+       photos: list(np.ndarray); the synthetic photos (cycled)
+       sizes: list(int); batch sizes
+       jobs: int; number of OCR worker processes
+       backend: str; OCR backend
+
+    Kwargs:
+       None
+
+    Return:
+       throughput: dict; receipts per second of each batch size, for the
+                   'pipeline' and the 'batch' driver
+    """
+    file_ids = write_photos(photos, max(sizes))
+    index = FileIndex()
+    options = dict(auto=True, preprocessing='native', ocr=backend)
+    drivers = {
+        'pipeline': lambda ids: run_pipeline(
+            ids, workers=parse_workers(None, jobs), index=index, **options),
+        'batch': lambda ids: run_batch(ids, jobs=jobs, index=index,
+                                       **options),
+    }
+    throughput = {}
+    for driver, run in sorted(drivers.items()):
+        throughput[driver] = {}
+        for size in sizes:
+            clear_cache()
+            start = time.time()
+            # failed receipts are reported by the drivers, not counted
+            done = sum(1 for _ in run(file_ids[:size]))
+            throughput[driver][size] = done/(time.time()-start)
+    return throughput
+
+
+def rates(results):
+    """
+    Fraction of correct extractions per field
+    """
+    if not results:
+        return {}
+    return dict((f, float(np.mean([r[f] for r in results])))
+                for f in results[0])
+
+
+def print_summary(summary):
+    """
+    Send the benchmark summary to stdout
+    """
+    print("{:<24}{:>6}{:>10}{:>10}{:>10}{:>10}".format(
+        "stage [ms]", "n", "mean", "median", "p95", "cpu"))
+    for stage, s in sorted(summary['stages'].items()):
+        print("{:<24}{:>6}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}".format(
+            stage, s['n'], s['mean'], s['median'], s['p95'], s['cpu']))
+    print("")
+    print("Throughput [receipts/s] with {} job(s), OCR: {}".format(
+        summary['jobs'], summary['ocr'] or "skipped"))
+    for driver, rates in sorted(summary['throughput'].items()):
+        print("  {}".format(driver))
+        for size, rate in sorted(rates.items()):
+            print("    batch {:>6}: {:>8.2f}".format(size, rate))
+    print("")
+    print("Scanner corner error [px]: mean {:.1f}, max {:.1f}".format(
+        np.mean(summary['corners']), np.max(summary['corners'])))
+    print("Scanner strategies: {}".format(summary['strategies']))
+    print("Parser accuracy on true text: {}".format(summary['parse']))
+    if summary['ocr']:
+        print("End-to-end accuracy: {}".format(summary['end_to_end']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark pentaplex on synthetic receipts")
+    parser.add_argument("-n", "--receipts", type=int, default=20,
+                        help="number of synthetic receipts")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 8, 32],
+                        help="batch sizes of the throughput benchmark")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of worker processes")
+    parser.add_argument("--photo", type=int, nargs=2, default=[2000, 1500],
+                        metavar=("HEIGHT", "WIDTH"),
+                        help="size of the synthetic photos")
+    parser.add_argument("--imagemagick", action="store_true",
+                        help="also time ImageMagick's preprocessing")
+    parser.add_argument("--no-ocr", action="store_true",
+                        help="skip the OCR stage")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None,
+                        help="also save the summary as json file")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    configs = Config.load()
+    samples = [synthesize(rng, configs, size=tuple(args.photo))
+               for _ in range(args.receipts)]
+    photos = [p for p, _ in samples]
+    truths = [t for _, t in samples]
+    backend = None if args.no_ocr else ocr_backend()
+    tmpdir = tempfile.mkdtemp(prefix="pentaplex-bench-")
+    # images, cache, and workspaces of the drivers go to a scratch layout
+    copy(layout.config, tmpdir)
+    layout.relocate(tmpdir)
+    try:
+        timings, accuracy = bench_stages(photos, truths, backend, tmpdir,
+                                         imagemagick=args.imagemagick)
+        throughput = {}
+        if backend:
+            # the drivers cannot run without OCR
+            throughput = bench_throughput(photos, args.sizes, args.jobs,
+                                          backend)
+    finally:
+        rmtree(tmpdir, ignore_errors=True)
+    strategies = {}
+    for s in accuracy['strategy']:
+        strategies[s] = strategies.get(s, 0) + 1
+    summary = {
+        'receipts': args.receipts,
+        'jobs': args.jobs,
+        'ocr': backend,
+        'stages': timings.summary(),
+        'throughput': throughput,
+        'corners': accuracy['corners'],
+        'strategies': strategies,
+        'parse': rates(accuracy['parse']),
+        'end_to_end': rates(accuracy['ocr']),
+    }
+    print_summary(summary)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+"""
+Content-addressed cache for the artifacts of pentaplex's pipeline stages
+
+@author: phdenzel
+
+"""
+import os
+import json
+import hashlib
+from mkpath import mkdir_p
+import metrics
+import layout
+
+
+def digest(*parts):
+    """
+    Hash arbitrary JSON-serializable parts into a cache key
+
+    Args:
+       parts: list; hash of the input and parameters of a stage
+
+    Kwargs:
+       None
+
+    Return:
+       key: str; hex digest of the parts
+    """
+    blob = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+def file_digest(path, blocksize=1 << 20):
+    """
+    Hash the contents of a file
+
+    Args:
+       path: str; path string to the file
+
+    Kwargs:
+       blocksize: int; number of bytes read at a time
+
+    Return:
+       key: str; hex digest of the file's bytes
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+            metrics.count('bytes_read', len(block))
+    return h.hexdigest()
+
+
+def stage_keys(input_hash, stages):
+    """
+    Chain the cache keys of consecutive stages, such that a change in any
+    stage's parameters invalidates that stage and all following ones
+
+    Args:
+       input_hash: str; hash of the input image's bytes
+       stages: list(tuple); (stage, params) pairs in pipeline order
+
+    Kwargs:
+       None
+
+    Return:
+       keys: dict; cache key for each stage
+    """
+    keys = {}
+    parent = input_hash
+    for stage, params in stages:
+        parent = digest(parent, stage, params)
+        keys[stage] = parent
+    return keys
+
+
+class ArtifactCache(object):
+    """
+    Artifacts of the scan, preprocessing and OCR stages stored under their
+    cache keys, with an append-only manifest mapping keys and file IDs
+    to the artifacts
+    """
+    stages = {
+        'scan': ('prp', 'dst_', '.jpg'),
+        'preprocessed': ('prp', '', '.png'),
+        'txt': ('txt', '', '.txt'),
+    }
+
+    _default = None
+
+    def __init__(self, prpd=None, txtd=None):
+        """
+        Initializes the cache and reads its manifest
+
+        Args:
+           None
+
+        Kwargs:
+           prpd: str; directory for scans and preprocessed images
+           txtd: str; directory for OCR text files
+        """
+        self.dirs = {'prp': prpd or layout.prpd,
+                     'txt': txtd or layout.txtd}
+        self.manifest = "".join([self.dirs['prp'], "manifest.jsonl"])
+        self._keys = {}
+        self._ids = {}
+        self._offset = 0
+        self.refresh()
+
+    @classmethod
+    def default(cls):
+        """
+        Cache instance shared by all receipts of a process
+
+        Return:
+           instance: ArtifactCache
+        """
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def refresh(self):
+        """
+        Read manifest entries appended since the last read, e.g. by other
+        worker processes
+
+        Args/Kwargs/Return:
+           None
+        """
+        if not os.path.isfile(self.manifest):
+            return
+        with open(self.manifest, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # entry still being written
+                self._offset += len(line)
+                entry = json.loads(line.decode('utf-8'))
+                self._keys[(entry['stage'], entry['key'])] = entry
+                self._ids[(entry['file_id'], entry['stage'])] = entry
+
+    def path(self, stage, key):
+        """
+        Path of a stage's artifact for a cache key
+
+        Args:
+           stage: str; either 'scan', 'preprocessed', or 'txt'
+           key: str; the stage's cache key
+
+        Kwargs:
+           None
+
+        Return:
+           path: str; path string to the artifact
+        """
+        d, prefix, ext = ArtifactCache.stages[stage]
+        return "".join([self.dirs[d], prefix, key, ext])
+
+    def lookup(self, stage, key):
+        """
+        Look up a stage's artifact by its cache key
+
+        Args:
+           stage: str; either 'scan', 'preprocessed', or 'txt'
+           key: str; the stage's cache key
+
+        Kwargs:
+           None
+
+        Return:
+           path: str; path string to the artifact, None if not cached
+        """
+        if (stage, key) not in self._keys:
+            self.refresh()
+        if (stage, key) in self._keys:
+            path = self.path(stage, key)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def latest(self, file_id, stage):
+        """
+        Look up the most recent artifact of a stage for a file ID
+
+        Args:
+           file_id: str; the file ID of the receipt's image
+           stage: str; either 'scan', 'preprocessed', or 'txt'
+
+        Kwargs:
+           None
+
+        Return:
+           path: str; path string to the artifact, None if not cached
+        """
+        entry = self._ids.get((file_id, stage))
+        if entry is None:
+            self.refresh()
+            entry = self._ids.get((file_id, stage))
+        if entry is not None:
+            path = self.path(stage, entry['key'])
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def artifacts(self, stage):
+        """
+        Most recent artifacts of a stage for all file IDs in the manifest
+
+        Args:
+           stage: str; either 'scan', 'preprocessed', or 'txt'
+
+        Kwargs:
+           None
+
+        Return:
+           paths: dict; path string to the artifact of each file ID
+        """
+        self.refresh()
+        paths = {}
+        for (file_id, s), entry in self._ids.items():
+            if s != stage:
+                continue
+            path = self.path(stage, entry['key'])
+            if os.path.isfile(path):
+                paths[file_id] = path
+        return paths
+
+    def inputs(self, stage):
+        """
+        Hashes of the images from which the most recent artifacts of a stage
+        were made, for all file IDs in the manifest
+
+        Args:
+           stage: str; either 'scan', 'preprocessed', or 'txt'
+
+        Kwargs:
+           None
+
+        Return:
+           hashes: dict; hex digest of the image of each file ID
+        """
+        self.refresh()
+        return dict((file_id, entry['input'])
+                    for (file_id, s), entry in self._ids.items()
+                    if s == stage and 'input' in entry)
+
+    def record(self, stage, key, file_id, **meta):
+        """
+        Append an artifact to the manifest, once it is written to its path
+
+        Args:
+           stage: str; either 'scan', 'preprocessed', or 'txt'
+           key: str; the stage's cache key
+           file_id: str; the file ID of the receipt's image
+
+        Kwargs:
+           meta: additional information stored in the manifest entry
+
+        Return:
+           None
+        """
+        latest = self._ids.get((file_id, stage))
+        if latest is not None and latest['key'] == key:
+            return
+        entry = dict(meta, stage=stage, key=key, file_id=file_id)
+        mkdir_p(self.dirs['prp'])
+        line = json.dumps(entry, sort_keys=True)+'\n'
+        with open(self.manifest, 'a') as f:
+            f.write(line)
+        self._keys[(stage, key)] = entry
+        self._ids[(file_id, stage)] = entry
+
+    def prepare(self, stage, key):
+        """
+        Make sure the directory for a stage's artifact exists
+
+        Args:
+           stage: str; either 'scan', 'preprocessed', or 'txt'
+           key: str; the stage's cache key
+
+        Kwargs:
+           None
+
+        Return:
+           path: str; path string to the artifact
+        """
+        path = self.path(stage, key)
+        mkdir_p(os.path.dirname(path))
+        return path
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Process-wide, precompiled fuzzy finding configurations from config.yml
+
+@author: phdenzel
+
+"""
+import os
+import re
+from objectify import objectify
+from matcher import FuzzyMatcher
+import layout
+
+
+def normalize(keys):
+    """
+    Normalize match keys the same way as the cleaned OCR text
+
+    Args:
+       keys: list(str); match keys from the config file
+
+    Kwargs:
+       None
+
+    Return:
+       keys: list(str); lower-case, stripped keys
+    """
+    return [("%s" % k).strip().lower() for k in (keys or [])]
+
+
+class Config(objectify):
+    """
+    Objectified config.yml with normalized key lists and precompiled
+    regular expressions, cached per process until the file changes
+    """
+    _loaded = {}
+
+    def __init__(self, docs):
+        """
+        Initializes the configurations from a parsed yaml document
+
+        Args:
+           docs: dict; the parsed yaml config file
+
+        Kwargs:
+           None
+        """
+        super(Config, self).__init__(dict(docs or {}))
+        self.total_keys = normalize(self.__dict__.get('total_keys'))
+        self.date_keys = normalize(self.__dict__.get('date_keys'))
+        self.time_keys = normalize(self.__dict__.get('time_keys'))
+        self.markets = dict(
+            (market, normalize(spellings)) for market, spellings
+            in (self.__dict__.get('markets') or {}).items())
+        # flat spelling table: (spelling, market) in config order
+        self.spellings = [(s, market) for market, spellings
+                          in self.markets.items() for s in spellings]
+        # fuzzy matcher over the whole vocabulary
+        self.matcher = FuzzyMatcher(
+            self.total_keys + self.date_keys + self.time_keys
+            + [s for s, _ in self.spellings])
+        # all formatted fields in one pattern (see extract.Candidates)
+        self.fields_re = self.combine(['date', 'time', 'total'])
+
+    def combine(self, fields):
+        """
+        Combine the formats of several fields into a single pattern which
+        captures, at every position where any format matches, each field's
+        match in a named group
+
+        Args:
+           fields: list(str); names of the fields, e.g. 'date' for the
+                   'date_format' pattern
+
+        Kwargs:
+           None
+
+        Return:
+           regex: re.RegexObject; compiled pattern, None if no field's
+                  format is configured
+        """
+        formats = [(f, self.__dict__.get(f+'_format')) for f in fields]
+        formats = [(f, p) for f, p in formats if p is not None]
+        if not formats:
+            return None
+        # zero-width: overlapping matches of different fields all count
+        guard = "|".join("(?:{})".format(p) for _, p in formats)
+        groups = "".join("(?=(?P<{}>{}))?".format(f, p) for f, p in formats)
+        return re.compile("(?={}){}".format(guard, groups))
+
+    @classmethod
+    def load(cls, config_path=None):
+        """
+        Load a yaml config file, parsing it only the first time and
+        whenever its modification time changed
+
+        Args:
+           None
+
+        Kwargs:
+           config_path: str; path string to the yaml config file
+
+        Return:
+           config: Config instance; the compiled configurations
+        """
+        config_path = config_path or layout.config
+        mtime = os.path.getmtime(config_path)
+        cached = cls._loaded.get(config_path)
+        if cached is None or cached[0] != mtime:
+            import yaml
+            with open(config_path, "r") as stream:
+                docs = yaml.safe_load(stream)
+            cached = (mtime, cls(docs))
+            cls._loaded[config_path] = cached
+        return cached[1]
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+Randomized equivalence checks of the single-pass text analysis against the
+plain searches it replaced: the fuzzy matcher against a per-keyword
+difflib scan, and the combined field pattern against per-field searches
+
+@author: phdenzel
+
+"""
+import re
+import sys
+import random
+import argparse
+from difflib import get_close_matches, SequenceMatcher
+from receipt import Receipt
+import layout
+
+NOISE = ["brot", "milch", "bar", "chf", "mwst", "rueckgeld", "karte", "x",
+         "1", "2x", "filiale", "danke", "kasse", "beleg", "nr", "eur"]
+LETTERS = "abcdefghijklmnopqrstuvwxyz0123456789"
+SEPARATORS = [".", ",", ", ", ". ", " ", "-", "/", ":"]
+
+
+def vocabulary(configs):
+    """
+    All keywords of the configured fuzzy vocabulary
+
+    Args:
+       configs: config.Config instance; the compiled configurations
+
+    Kwargs:
+       None
+
+    Return:
+       keys: list(str); total, date, and time keys, and market spellings
+    """
+    return list(configs.matcher.keys)
+
+
+def typo(rng, word):
+    """
+    A word with a random OCR-like error: a character dropped, replaced,
+    inserted, or two swapped
+
+    Args:
+       rng: random.Random instance; the random number generator
+       word: str; the original word
+
+    Kwargs:
+       None
+
+    Return:
+       word: str; the misspelled word
+    """
+    if not word:
+        return word
+    i = rng.randrange(len(word))
+    kind = rng.choice(('drop', 'replace', 'insert', 'swap'))
+    if kind == 'drop':
+        return word[:i] + word[i+1:]
+    if kind == 'replace':
+        return word[:i] + rng.choice(LETTERS) + word[i+1:]
+    if kind == 'insert':
+        return word[:i] + rng.choice(LETTERS) + word[i:]
+    if i+1 < len(word):
+        return word[:i] + word[i+1] + word[i] + word[i+2:]
+    return word
+
+
+def number(rng):
+    """
+    A random date-, time-, or amount-like token with arbitrary separators,
+    such that the field formats match, overlap, or just fail to match
+
+    Args:
+       rng: random.Random instance; the random number generator
+
+    Kwargs:
+       None
+
+    Return:
+       token: str; e.g. '12.03.2017', '14:22', or '12, 50'
+    """
+    parts = [str(rng.randint(0, 99)).zfill(rng.choice((1, 2, 2)))
+             for _ in range(rng.randint(1, 3))]
+    if len(parts) == 3 and rng.random() < 0.7:
+        parts[2] = str(rng.randint(1990, 2030))
+    token = parts[0]
+    for p in parts[1:]:
+        token += rng.choice(SEPARATORS) + p
+    if rng.random() < 0.2:
+        token = rng.choice(("chf", "fr.", "*", "-")) + token
+    return token
+
+
+def random_text(rng, keys, lines=(3, 15), words=(1, 6)):
+    """
+    Random OCR text of keywords, misspelled keywords, dates, times,
+    amounts, and noise
+
+    Args:
+       rng: random.Random instance; the random number generator
+       keys: list(str); keywords of the vocabulary
+
+    Kwargs:
+       lines: tuple(int); least and most number of lines
+       words: tuple(int); least and most number of words per line
+
+    Return:
+       lines: list(str); the text lines
+    """
+    text = []
+    for _ in range(rng.randint(*lines)):
+        line = []
+        for _ in range(rng.randint(*words)):
+            r = rng.random()
+            if r < 0.2:
+                line.append(rng.choice(keys))
+            elif r < 0.4:
+                word = rng.choice(keys)
+                for _ in range(rng.randint(1, 3)):
+                    word = typo(rng, word)
+                line.append(word)
+            elif r < 0.7:
+                line.append(number(rng))
+            else:
+                line.append(rng.choice(NOISE))
+        text.append(" ".join(line)+"\n")
+    return text
+
+
+def reference_line(lines, key, accuracy):
+    """
+    Number of the first line with a word close to a keyword, by a plain
+    difflib scan (first-line-wins)
+    """
+    for i, line in enumerate(lines):
+        if get_close_matches(key, line.split(), 1, accuracy):
+            return i
+    return None
+
+
+def reference_score(line, key):
+    """
+    Best similarity of a line's words to a keyword, by difflib
+    """
+    return max(SequenceMatcher(None, w, key).ratio() for w in line.split())
+
+
+def check_matcher(receipt, keys, accuracies=(0.6, 0.8)):
+    """
+    Compare the matched line and score of every keyword in a receipt's
+    text with the plain difflib scan
+
+    Args:
+       receipt: Receipt instance; an analyzed receipt
+       keys: list(str); keywords of the vocabulary
+
+    Kwargs:
+       accuracies: tuple(float); lowest scores which count as a match
+
+    Return:
+       checked: int; number of compared lookups
+       mismatches: list(tuple); keyword, accuracy, and both results of
+                   every lookup which differs
+    """
+    checked, mismatches = 0, []
+    for accuracy in accuracies:
+        for key in keys:
+            i, score = receipt.matches.locate(key, accuracy)
+            ref = reference_line(receipt.text, key, accuracy)
+            ref_score = 0
+            if ref is not None:
+                ref_score = reference_score(receipt.text[ref], key)
+            checked += 1
+            if (i, score) != (ref, ref_score):
+                mismatches.append((key, accuracy, (i, score),
+                                   (ref, ref_score)))
+    return checked, mismatches
+
+
+def reference_fields(receipt):
+    """
+    Date, time, and total of a receipt's text by the plain searches: each
+    field's format per line, and the total format on the comma-replaced
+    line of the first total key found by the difflib scan
+    """
+    configs = receipt.configs
+    fields = {}
+    for field in ('date', 'time'):
+        regex = re.compile(getattr(configs, field+'_format'))
+        fields[field] = None
+        for line in receipt.text:
+            m = regex.search(line)
+            if m:
+                fields[field] = m.group()
+                break
+    total_re = re.compile(configs.total_format)
+    fields['total'] = None
+    for key in configs.total_keys:
+        i = reference_line(receipt.text, key, 0.6)
+        if i is not None:
+            m = total_re.search(receipt.text[i].replace(',', '.'))
+            if m:
+                fields['total'] = m.group()
+                break
+    return fields
+
+
+def check_fields(receipt):
+    """
+    Compare a receipt's date, time, and total with the plain searches
+
+    Args:
+       receipt: Receipt instance; an analyzed receipt
+
+    Kwargs:
+       None
+
+    Return:
+       checked: int; number of compared fields
+       mismatches: list(tuple); field, and both results of every field
+                   which differs
+    """
+    checked, mismatches = 0, []
+    for field, ref in sorted(reference_fields(receipt).items()):
+        value = getattr(receipt, field)
+        checked += 1
+        if value != ref:
+            mismatches.append((field, value, ref))
+    return checked, mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Check the single-pass text analysis against the plain "
+        "searches on random texts")
+    parser.add_argument("-n", "--texts", type=int, default=3000,
+                        help="number of random texts")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    keys = vocabulary(Receipt.load_configs(layout.config))
+    checked, mismatches = [0, 0], [[], []]
+    for n in range(args.texts):
+        receipt = Receipt.from_text(str(n), random_text(rng, keys))
+        c, m = check_matcher(receipt, keys)
+        checked[0] += c
+        mismatches[0] += [(n,)+mm for mm in m]
+        c, m = check_fields(receipt)
+        checked[1] += c
+        mismatches[1] += [(n,)+mm for mm in m]
+    print("matcher: {} lookups in {} texts, {} mismatches".format(
+        checked[0], args.texts, len(mismatches[0])))
+    for mm in mismatches[0][:10]:
+        print("  text {}: {!r} at {}: {} != {}".format(*mm))
+    print("fields: {} fields in {} texts, {} mismatches".format(
+        checked[1], args.texts, len(mismatches[1])))
+    for mm in mismatches[1][:10]:
+        print("  text {}: {}: {!r} != {!r}".format(*mm))
+    return 1 if any(mismatches) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+"""
+Single-pass extraction of the formatted fields (date, time, total) from
+OCR text
+
+@author: phdenzel
+
+"""
+
+
+class Candidates(object):
+    """
+    Table of every match of the fields' formats in a text, with its line
+    number and position, found in a single pass with a combined pattern
+    (see config.Config.combine)
+    """
+
+    def __init__(self, regex, lines):
+        """
+        Initializes the table by scanning the text once
+
+        Args:
+           regex: re.RegexObject; combined pattern with a named group per
+                  field, None for an empty table
+           lines: list(str); the cleaned OCR text
+
+        Kwargs:
+           None
+        """
+        self.table = []
+        self._first = {}
+        self._lines = {}
+        if regex is None:
+            return
+        fields = sorted(regex.groupindex)
+        for i, line in enumerate(lines):
+            for m in regex.finditer(line):
+                for field in fields:
+                    value = m.group(field)
+                    if value is None:
+                        continue
+                    self.table.append((i, m.start(), field, value))
+                    self._first.setdefault(field, (i, m.start(), value))
+                    self._lines.setdefault((field, i), value)
+
+    def __len__(self):
+        return len(self.table)
+
+    def first(self, field):
+        """
+        First match of a field in the text (first-line-wins)
+
+        Args:
+           field: str; name of the field, e.g. 'date'
+
+        Kwargs:
+           None
+
+        Return:
+           value: str; the leftmost match on the first matching line, None
+                  if there is none
+        """
+        found = self._first.get(field)
+        return found[2] if found else None
+
+    def on_line(self, field, line):
+        """
+        First match of a field on a given line
+
+        Args:
+           field: str; name of the field, e.g. 'total'
+           line: int; the line number
+
+        Kwargs:
+           None
+
+        Return:
+           value: str; the leftmost match on the line, None if there is none
+        """
+        return self._lines.get((field, line))
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+Index of the receipt images and their artifacts by file ID
+
+@author: phdenzel
+
+"""
+import os
+import layout
+
+
+def image_id(filename):
+    """
+    File ID of a receipt image, e.g. IMG_0101010.JPG has file_id='0101010';
+    other name formats use the image's name w/o extension
+
+    Args:
+       filename: str; name string of the image
+
+    Kwargs:
+       None
+
+    Return:
+       file_id: str; the image's file ID
+    """
+    name = os.path.splitext(os.path.basename(filename))[0]
+    for prefix in ("IMG_", "img_"):
+        if name.startswith(prefix):
+            return name[len(prefix):]
+    return name
+
+
+def listdir(path):
+    """
+    List the visible files of a directory, which may not exist
+
+    Args:
+       path: str; path string to the directory
+
+    Kwargs:
+       None
+
+    Return:
+       names: list(str); file names in the directory
+    """
+    if not os.path.isdir(path):
+        return []
+    return [n for n in os.listdir(path) if not n.startswith(".")]
+
+
+class FileIndex(object):
+    """
+    Maps file IDs to the receipt images in imgs/ and the (legacy) artifacts
+    in prp/ and txt/, built with a single directory listing each
+    """
+    _default = None
+
+    def __init__(self, imgd=None, prpd=None, txtd=None):
+        """
+        Initializes the index by listing the directories
+
+        Args:
+           None
+
+        Kwargs:
+           imgd: str; directory of the receipt images
+           prpd: str; directory of the scans and preprocessed images
+           txtd: str; directory of the OCR text files
+        """
+        self.imgd = imgd or layout.imgd
+        self.prpd = prpd or layout.prpd
+        self.txtd = txtd or layout.txtd
+        self.build()
+
+    @classmethod
+    def default(cls):
+        """
+        Index shared by all receipts of a process
+
+        Return:
+           instance: FileIndex
+        """
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def build(self):
+        """
+        (Re-)build the index from the directory listings
+
+        Args/Kwargs/Return:
+           None
+        """
+        self.images = {}
+        for name in sorted(listdir(self.imgd)):
+            self.images.setdefault(image_id(name), name)
+        prp = listdir(self.prpd)
+        txt = listdir(self.txtd)
+        # <prepid>.png and <prepid>.txt keyed by the prepid
+        prepds = {}
+        for name in prp:
+            base, ext = os.path.splitext(name)
+            if ext == ".png":
+                prepds[base] = name
+        texts = {}
+        for name in txt:
+            base, ext = os.path.splitext(name)
+            if ext == ".txt":
+                texts[base] = name
+        # dst_<file_id>.jpg and <prepid>_<file_id>.jpg
+        self.scans = {}
+        self.ocr = {}
+        for name in prp:
+            base, ext = os.path.splitext(name)
+            if ext != ".jpg" or "_" not in base:
+                continue
+            prefix, file_id = base.split("_", 1)
+            if prefix == "dst":
+                self.scans[file_id] = name
+            elif prefix in prepds and prefix in texts:
+                self.ocr[file_id] = (prepds[prefix], texts[prefix])
+
+    def ids(self):
+        """
+        File IDs of all receipt images
+
+        Args/Kwargs:
+           None
+
+        Return:
+           ids: list(str); sorted file IDs
+        """
+        return sorted(self.images)
+
+    def image(self, file_id):
+        """
+        Name string of the receipt image with given file ID, or None
+        """
+        return self.images.get(file_id)
+
+    def scan(self, file_id):
+        """
+        Name string of the scan in prp/ with given file ID, or None
+        """
+        return self.scans.get(file_id)
+
+    def ocr_files(self, file_id):
+        """
+        Name strings of the preprocessed image in prp/ and the OCR text
+        in txt/ with given file ID, or None
+        """
+        return self.ocr.get(file_id)
+
+    def texts(self):
+        """
+        Paths of the (legacy) OCR text files of all file IDs
+
+        Args/Kwargs:
+           None
+
+        Return:
+           paths: dict; path string to the txt file of each file ID
+        """
+        return dict((file_id, self.txtd+names[1])
+                    for file_id, names in self.ocr.items())
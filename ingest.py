@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+Memory-mapped ingestion of receipt photos: each file is mapped once, then
+hashed for the cache keys and decoded from the same buffer
+
+@author: phdenzel
+
+"""
+import os
+import mmap
+import hashlib
+import numpy as np
+import cv2
+import metrics
+
+try:
+    # Python 3
+    FileNotFoundError
+except NameError:
+    # Python 2
+    FileNotFoundError = IOError
+
+# decoding flags of the reduced resolutions, by reduction factor
+REDUCED = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def reduction(shape, size):
+    """
+    Largest reduction factor which keeps an image's longest side at least
+    at a given size
+
+    Args:
+       shape: tuple(int); shape of the full resolution image
+       size: int; smallest acceptable length of the longest side
+
+    Kwargs:
+       None
+
+    Return:
+       factor: int; one of the keys of REDUCED
+    """
+    longest = max(shape[:2])
+    for factor in sorted(REDUCED, reverse=True):
+        if longest // factor >= size:
+            return factor
+    return 1
+
+
+class Ingested(object):
+    """
+    A receipt photo mapped into memory; the bytes are read from disk once,
+    for the hash as well as for every decoding
+    """
+
+    def __init__(self, path):
+        """
+        Initializes the ingestion by mapping the file
+
+        Args:
+           path: str; path string to the image file
+
+        Kwargs:
+           None
+        """
+        self.path = path
+        self._digest = None
+        with open(path, 'rb') as f:
+            self.size = os.fstat(f.fileno()).st_size
+            if self.size:
+                self.buffer = mmap.mmap(f.fileno(), 0,
+                                        access=mmap.ACCESS_READ)
+            else:
+                self.buffer = b''
+        metrics.count('bytes_read', self.size)
+
+    def __repr__(self):
+        return "Ingested({!r})".format(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def closed(self):
+        return self.buffer is None
+
+    @property
+    def digest(self):
+        """
+        Hex digest of the file's bytes (see cache.file_digest), computed once
+        """
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.buffer).hexdigest()
+        return self._digest
+
+    def decode(self, factor=1):
+        """
+        Decode the image from the mapped bytes
+
+        Args:
+           None
+
+        Kwargs:
+           factor: int; reduction factor of the resolution, 1, 2, 4, or 8
+                   (JPEGs are decoded directly at the reduced resolution)
+
+        Return:
+           image: np.ndarray; the decoded BGR image
+        """
+        image = None
+        if self.size:
+            data = np.frombuffer(self.buffer, dtype=np.uint8)
+            image = cv2.imdecode(data, REDUCED[factor])
+            del data  # the map can only be closed without exported views
+        if image is None:
+            raise FileNotFoundError(
+                "No decodable image found: {}".format(self.path))
+        return image
+
+    def close(self):
+        """
+        Unmap the file; the digest stays available
+
+        Args/Kwargs/Return:
+           None
+        """
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.buffer = None
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""
+Append-only progress journal of the receipts completed by a batch run
+
+@author: phdenzel
+
+"""
+import os
+import json
+from cache import file_digest
+import layout
+
+
+def stat(path):
+    """
+    Size and modification time of a file, to detect changed inputs without
+    re-reading them
+
+    Args:
+       path: str; path string to the file
+
+    Kwargs:
+       None
+
+    Return:
+       stat: list; [size, mtime] of the file, None if it does not exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime]
+
+
+class Journal(object):
+    """
+    Completed receipts with the hash of their input, the run parameters and
+    the extracted fields, one JSON line each
+    """
+    def __init__(self, path=None):
+        """
+        Initializes the journal by reading its entries
+
+        Args:
+           None
+
+        Kwargs:
+           path: str; path string to the journal file
+        """
+        self.path = path or layout.journal
+        self.entries = {}
+        if os.path.isfile(self.path):
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break  # interrupted while writing
+                    entry = json.loads(line.decode('utf-8'))
+                    self.entries[entry['file_id']] = entry
+
+    def reset(self):
+        """
+        Forget all completed receipts and empty the journal file, e.g. when
+        the output they were written to is rewritten
+
+        Args/Kwargs/Return:
+           None
+        """
+        with open(self.path, 'w'):
+            pass
+        self.entries = {}
+
+    def done(self, file_id, path, params):
+        """
+        Check if a receipt was completed with the same input and parameters;
+        an unchanged size and modification time are confirmed by the hash
+        of the input's bytes, a changed one is enough to redo the receipt
+
+        Args:
+           file_id: str; the file ID of the receipt
+           path: str; path string to the receipt's input file
+           params: str; digest of the run parameters
+
+        Kwargs:
+           None
+
+        Return:
+           done: bool; True if the receipt can be skipped
+        """
+        entry = self.entries.get(file_id)
+        if entry is None:
+            return False
+        if entry['params'] != params or entry['stat'] != stat(path):
+            return False
+        return entry.get('digest') == file_digest(path)
+
+    def record(self, file_id, path, params, fields):
+        """
+        Append a completed receipt to the journal
+
+        Args:
+           file_id: str; the file ID of the receipt
+           path: str; path string to the receipt's input file
+           params: str; digest of the run parameters
+           fields: dict; the extracted fields, incl. the input's hash
+
+        Kwargs:
+           None
+
+        Return:
+           None
+        """
+        entry = {
+            'file_id': file_id,
+            'input': fields.get('input'),
+            'stat': stat(path),
+            'digest': file_digest(path),
+            'params': params,
+            'fields': dict((k, v) for k, v in fields.items()
+                           if k not in ('file_id', 'input', 'metrics',
+                                        'lines')),
+        }
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry, sort_keys=True)+'\n')
+        self.entries[file_id] = entry
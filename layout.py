@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Directory layout of pentaplex: the receipt images, the cached artifacts,
+the receipts' workspaces, and the default config, journal, and database
+files, all under one root directory; modules read the paths from here at
+call time, such that relocate() moves all of them at once
+
+@author: phdenzel
+
+"""
+import os
+
+# root directory of child processes, see relocate
+ENV = "PENTAPLEX_ROOT"
+
+root = None
+imgd = None
+prpd = None
+txtd = None
+tmpd = None
+config = None
+journal = None
+db = None
+
+
+def place(path):
+    """
+    Set all paths of the layout under a root directory (in this process)
+
+    Args:
+       path: str; path string to the root directory
+
+    Kwargs:
+       None
+
+    Return:
+       None
+    """
+    global root, imgd, prpd, txtd, tmpd, config, journal, db
+    root = os.path.join(os.path.realpath(path), "")
+    imgd = "".join([root, "imgs/"])
+    prpd = "".join([root, "prp/"])
+    txtd = "".join([root, "txt/"])
+    tmpd = "".join([root, "tmp/"])
+    config = "".join([root, "config.yml"])
+    journal = "".join([root, "journal.jsonl"])
+    db = "".join([root, "receipts.db"])
+
+
+def relocate(path):
+    """
+    Move the whole layout to another root directory, e.g. a scratch copy
+    for benchmarks; worker processes started afterwards inherit it, but
+    caches and indices built before keep their directories
+
+    Args:
+       path: str; path string to the new root directory
+
+    Kwargs:
+       None
+
+    Return:
+       None
+    """
+    place(path)
+    os.environ[ENV] = root
+
+
+place(os.environ.get(ENV) or os.path.dirname(os.path.realpath(__file__)))
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+Indexed fuzzy keyword matching over OCR text
+
+@author: phdenzel
+
+"""
+import math
+from collections import Counter
+from difflib import SequenceMatcher
+
+
+class FuzzyMatcher(object):
+    """
+    Matches all keywords of a vocabulary against the words of a text in a
+    single pass; scores are difflib's similarity ratios (as used by
+    get_close_matches), with keywords indexed by length and character
+    counts to skip comparisons which cannot reach the cutoff, and scores
+    memoized per word
+    """
+    memo_size = 1 << 16
+
+    def __init__(self, keys, cutoff=0.6):
+        """
+        Initializes the matcher by indexing the keywords
+
+        Args:
+           keys: list(str); the vocabulary of keywords
+
+        Kwargs:
+           cutoff: float; lowest score which counts as a match
+        """
+        self.cutoff = cutoff
+        self.keys = []
+        for key in keys:
+            if key not in self.keys:
+                self.keys.append(key)
+        self._by_length = {}
+        self._counts = {}
+        self._matchers = {}
+        for key in self.keys:
+            self._by_length.setdefault(len(key), []).append(key)
+            self._counts[key] = Counter(key)
+            s = SequenceMatcher()
+            s.set_seq2(key)
+            self._matchers[key] = s
+        self._memo = {}
+        self.comparisons = 0
+
+    def __contains__(self, key):
+        return key in self._matchers
+
+    def candidates(self, word):
+        """
+        Keywords whose length allows a score of at least the cutoff
+
+        Args:
+           word: str; a word of the text
+
+        Kwargs:
+           None
+
+        Return:
+           keys: list(str); candidate keywords
+        """
+        n = len(word)
+        c = self.cutoff
+        lo = int(math.ceil(c*n/(2-c)-1e-9))
+        hi = int(math.floor(n*(2-c)/c+1e-9))
+        keys = []
+        for m in range(lo, hi+1):
+            keys.extend(self._by_length.get(m, ()))
+        return keys
+
+    def scores(self, word):
+        """
+        Scores of a word against all keywords, memoized
+
+        Args:
+           word: str; a word of the text
+
+        Kwargs:
+           None
+
+        Return:
+           scores: dict; score of each keyword reaching the cutoff
+        """
+        if word in self._memo:
+            return self._memo[word]
+        if len(self._memo) >= FuzzyMatcher.memo_size:
+            self._memo.clear()
+        scores = {}
+        counts = None
+        for key in self.candidates(word):
+            # upper bound from the character counts (difflib's quick_ratio)
+            if counts is None:
+                counts = Counter(word)
+            common = sum((counts & self._counts[key]).values())
+            if 2.0*common/(len(word)+len(key)) < self.cutoff:
+                continue
+            s = self._matchers[key]
+            s.set_seq1(word)
+            self.comparisons += 1
+            score = s.ratio()
+            if score >= self.cutoff:
+                scores[key] = score
+        self._memo[word] = scores
+        return scores
+
+    def match(self, lines):
+        """
+        Match all keywords against the words of every line in one pass
+
+        Args:
+           lines: list(str); the cleaned OCR text
+
+        Kwargs:
+           None
+
+        Return:
+           matches: Matches; the lines matching each keyword
+        """
+        hits = {}
+        for i, line in enumerate(lines):
+            best = {}
+            for word in line.split():
+                for key, score in self.scores(word).items():
+                    if score > best.get(key, 0):
+                        best[key] = score
+            for key, score in best.items():
+                hits.setdefault(key, []).append((i, score))
+        return Matches(lines, hits)
+
+
+class Matches(object):
+    """
+    Lines of a text matching each keyword of a FuzzyMatcher, in text order
+    """
+
+    def __init__(self, lines, hits):
+        """
+        Initializes the matches
+
+        Args:
+           lines: list(str); the matched text
+           hits: dict; (line number, best score in line) of each keyword
+
+        Kwargs:
+           None
+        """
+        self.lines = lines
+        self.hits = hits
+
+    def find(self, key, accuracy=0.6):
+        """
+        First line with a word matching a keyword and its score
+
+        Args:
+           key: str; the keyword
+
+        Kwargs:
+           accuracy: float; lowest score which counts as a match
+
+        Return:
+           line, score: str, float; the first matching line and the best
+                        score of its words, (None, 0) if there is none
+        """
+        i, score = self.locate(key, accuracy)
+        if i is None:
+            return None, 0
+        return self.lines[i], score
+
+    def locate(self, key, accuracy=0.6):
+        """
+        Number of the first line with a word matching a keyword
+
+        Args:
+           key: str; the keyword
+
+        Kwargs:
+           accuracy: float; lowest score which counts as a match
+
+        Return:
+           i, score: int, float; the first matching line's number and the
+                     best score of its words, (None, 0) if there is none
+        """
+        for i, score in self.hits.get(key, ()):
+            if score >= accuracy:
+                return i, score
+        return None, 0
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+"""
+Per-receipt timings and counters of the pipeline stages, with percentile
+summaries exportable as JSON or Prometheus text
+
+@author: phdenzel
+
+"""
+import os
+import re
+import time
+import json
+from contextlib import contextmanager
+
+
+def cpu_time():
+    """
+    CPU time of the process in seconds
+    """
+    if hasattr(time, 'process_time'):
+        return time.process_time()
+    return time.clock()
+
+
+def percentile(values, q):
+    """
+    Percentile of a list of values, linearly interpolated
+
+    Args:
+       values: list(float); the values
+       q: float; the percentile between 0 and 100
+
+    Kwargs:
+       None
+
+    Return:
+       value: float; the q-th percentile, None for no values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values)-1)*q/100.
+    lo = int(pos)
+    hi = min(lo+1, len(values)-1)
+    return values[lo] + (values[hi]-values[lo])*(pos-lo)
+
+
+class Metrics(object):
+    """
+    Wall and CPU seconds of the stages and counters of a single receipt;
+    repeated stages add up
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the enclosed block as a stage
+
+        Args:
+           name: str; name of the stage, e.g. 'scan'
+
+        Kwargs:
+           None
+
+        Return:
+           None
+        """
+        wall, cpu = time.time(), cpu_time()
+        try:
+            yield
+        finally:
+            spent = self.stages.setdefault(name, [0., 0.])
+            spent[0] += time.time()-wall
+            spent[1] += cpu_time()-cpu
+
+    def count(self, name, n=1):
+        """
+        Increase a counter
+
+        Args:
+           name: str; name of the counter, e.g. 'bytes_read'
+
+        Kwargs:
+           n: int; increment
+
+        Return:
+           None
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self):
+        """
+        Picklable copy of the timings and counters
+
+        Args/Kwargs:
+           None
+
+        Return:
+           metrics: dict; 'stages' as {name: [wall, cpu]} and 'counters'
+        """
+        return {'stages': dict((k, list(v)) for k, v in self.stages.items()),
+                'counters': dict(self.counters)}
+
+
+# metrics of the receipt in flight in this process, see begin
+_active = Metrics()
+
+
+def begin():
+    """
+    Start recording the metrics of a new receipt in this process
+
+    Args/Kwargs:
+       None
+
+    Return:
+       metrics: Metrics instance; the new active recorder
+    """
+    global _active
+    _active = Metrics()
+    return _active
+
+
+def stage(name):
+    """
+    Time the enclosed block as a stage of the active receipt
+    """
+    return _active.stage(name)
+
+
+def count(name, n=1):
+    """
+    Increase a counter of the active receipt
+    """
+    _active.count(name, n)
+
+
+def merge(*records):
+    """
+    Add up the metrics of a receipt recorded in several processes
+
+    Args:
+       records: dict; outputs of Metrics.as_dict, None is skipped
+
+    Kwargs:
+       None
+
+    Return:
+       metrics: dict; the combined 'stages' and 'counters'
+    """
+    m = Metrics()
+    for record in records:
+        if record is None:
+            continue
+        for name, (wall, cpu) in record['stages'].items():
+            spent = m.stages.setdefault(name, [0., 0.])
+            spent[0] += wall
+            spent[1] += cpu
+        for name, n in record['counters'].items():
+            m.count(name, n)
+    return m.as_dict()
+
+
+def count_file(name, path):
+    """
+    Increase a byte counter of the active receipt by a file's size
+    """
+    try:
+        _active.count(name, os.path.getsize(path))
+    except OSError:
+        pass
+
+
+class Summary(object):
+    """
+    Metrics of all receipts of a run, summarized as percentiles
+    """
+    quantiles = (50, 90, 99)
+
+    def __init__(self):
+        self.receipts = {}
+
+    def add(self, file_id, metrics):
+        """
+        Add the metrics of a receipt
+
+        Args:
+           file_id: str; the file ID of the receipt
+           metrics: dict; output of Metrics.as_dict, ignored if None
+
+        Kwargs:
+           None
+
+        Return:
+           None
+        """
+        if metrics is not None:
+            self.receipts[file_id] = metrics
+
+    def values(self, kind, name, index=None):
+        """
+        Values of a stage or counter over all receipts which have it
+        """
+        found = []
+        for m in self.receipts.values():
+            if name in m[kind]:
+                v = m[kind][name]
+                found.append(v if index is None else v[index])
+        return found
+
+    def names(self, kind):
+        """
+        Sorted names of all stages or counters
+        """
+        names = set()
+        for m in self.receipts.values():
+            names.update(m[kind])
+        return sorted(names)
+
+    def summary(self):
+        """
+        Percentiles of the stages' wall and CPU seconds, and percentiles and
+        totals of the counters
+
+        Args/Kwargs:
+           None
+
+        Return:
+           summary: dict; 'stages' and 'counters' by name
+        """
+        stages = {}
+        for name in self.names('stages'):
+            stats = {}
+            for i, clock in enumerate(('wall', 'cpu')):
+                values = self.values('stages', name, i)
+                stats[clock] = dict(
+                    [('p{}'.format(q), percentile(values, q))
+                     for q in self.quantiles]
+                    + [('sum', sum(values)), ('count', len(values))])
+            stages[name] = stats
+        counters = {}
+        for name in self.names('counters'):
+            values = self.values('counters', name)
+            counters[name] = dict(
+                [('p{}'.format(q), percentile(values, q))
+                 for q in self.quantiles]
+                + [('sum', sum(values)), ('count', len(values))])
+        return {'receipts': len(self.receipts), 'stages': stages,
+                'counters': counters}
+
+    def to_json(self):
+        """
+        The summary and the metrics of every receipt as JSON
+
+        Args/Kwargs:
+           None
+
+        Return:
+           text: str; JSON document
+        """
+        return json.dumps({'summary': self.summary(),
+                           'receipts': self.receipts},
+                          indent=2, sort_keys=True)
+
+    def to_prometheus(self, prefix='pentaplex'):
+        """
+        The summary in Prometheus' text exposition format
+
+        Args:
+           None
+
+        Kwargs:
+           prefix: str; prefix of the metric names
+
+        Return:
+           text: str; one sample per line
+        """
+        s = self.summary()
+        lines = []
+        for clock, label in (('wall', 'Wall'), ('cpu', 'CPU')):
+            metric = "{}_stage_{}_seconds".format(prefix, clock)
+            lines += ["# HELP {} {} seconds of a stage per receipt".format(
+                metric, label), "# TYPE {} summary".format(metric)]
+            for name, stats in sorted(s['stages'].items()):
+                lines += summary_samples(metric, stats[clock],
+                                         'stage="{}"'.format(name))
+        for name, stats in sorted(s['counters'].items()):
+            metric = "{}_{}".format(prefix, re.sub(r'\W', '_', name))
+            lines += ["# HELP {} {} per receipt".format(metric, name),
+                      "# TYPE {} summary".format(metric)]
+            lines += summary_samples(metric, stats)
+        return "\n".join(lines)+"\n"
+
+    def save(self, path):
+        """
+        Export the metrics; Prometheus text for *.prom files, else JSON
+
+        Args:
+           path: str; path string to the output file
+
+        Kwargs:
+           None
+
+        Return:
+           None
+        """
+        with open(path, 'w') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                f.write(self.to_json()+"\n")
+
+    def print_summary(self):
+        """
+        Send the percentiles of every stage and counter to stdout
+
+        Args/Kwargs/Return:
+           None
+        """
+        s = self.summary()
+        print("Metrics of {} receipt(s)".format(s['receipts']))
+        header = "".join(["{:>10}".format("p{}".format(q))
+                          for q in self.quantiles])
+        print("{:<20}{:>6}{}{:>10}".format("stage [s]", "n", header,
+                                           "cpu p50"))
+        for name, stats in sorted(s['stages'].items()):
+            wall = stats['wall']
+            print("{:<20}{:>6}{}{:>10.3f}".format(
+                name, wall['count'],
+                "".join(["{:>10.3f}".format(wall['p{}'.format(q)])
+                         for q in self.quantiles]),
+                stats['cpu']['p50']))
+        print("{:<20}{:>6}{}{:>10}".format("counter", "n", header, "total"))
+        for name, stats in sorted(s['counters'].items()):
+            print("{:<20}{:>6}{}{:>10}".format(
+                name, stats['count'],
+                "".join(["{:>10.0f}".format(stats['p{}'.format(q)])
+                         for q in self.quantiles]),
+                stats['sum']))
+
+
+def summary_samples(metric, stats, labels=""):
+    """
+    Prometheus samples of a summary's quantiles, sum and count
+
+    Args:
+       metric: str; name of the metric
+       stats: dict; percentiles 'p<q>', 'sum', and 'count'
+
+    Kwargs:
+       labels: str; additional labels, e.g. 'stage="scan"'
+
+    Return:
+       lines: list(str); the samples
+    """
+    sep = "," if labels else ""
+    lines = []
+    for q in Summary.quantiles:
+        lines.append('{}{{{}{}quantile="{}"}} {}'.format(
+            metric, labels, sep, q/100., stats['p{}'.format(q)]))
+    braces = "{{{}}}".format(labels) if labels else ""
+    lines.append("{}_sum{} {}".format(metric, braces, stats['sum']))
+    lines.append("{}_count{} {}".format(metric, braces, stats['count']))
+    return lines
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+"""
+@author: phdenzel
+
+Optical character recognition of preprocessed scans with tesseract
+"""
+import io
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+LANGUAGES = 'deu+eng'
+DPI = 350
+
+# OCR parameters per engine (part of the OCR text's cache key)
+ENGINES = {
+    'cli': {'engine': 'tesseract', 'lang': LANGUAGES},
+    'api': {'engine': 'tesserocr', 'lang': LANGUAGES, 'dpi': DPI},
+    # header and footer text lines first, the full page only on demand
+    'roi': {'engine': 'roi', 'lang': LANGUAGES, 'dpi': DPI, 'head': 5,
+            'foot': 15, 'min_ink': 0.01, 'pad': 8},
+}
+
+
+def tesseract(src, dst, lang=LANGUAGES):
+    """
+    Run the tesseract command line tool on a preprocessed scan
+
+    Args:
+       src: str; path string to the preprocessed image
+       dst: str; path string to the txt output file
+
+    Kwargs:
+       lang: str; tesseract languages, e.g. 'deu+eng'
+
+    Return:
+       dst: str; path string to the txt output file
+    """
+    # tesseract appends the .txt extension itself
+    base = dst[:-len(".txt")] if dst.endswith(".txt") else dst
+    subprocess.check_call(["tesseract", "-l", lang, src, base])
+    return base+".txt"
+
+
+def write_text(lines, dst):
+    """
+    Write recognized text lines to a txt file
+
+    Args:
+       lines: list(str); the recognized text lines
+       dst: str; path string to the txt output file
+
+    Kwargs:
+       None
+
+    Return:
+       dst: str; path string to the txt output file
+    """
+    with io.open(dst, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line+u'\n')
+    return dst
+
+
+def text_bands(img, min_ink=0.01, min_gap=3, min_height=6):
+    """
+    Text line bands of a preprocessed scan from its horizontal projection
+    profile, i.e. the fraction of dark pixels in each row
+
+    Args:
+       img: np.ndarray; preprocessed grayscale image, dark text on white
+
+    Kwargs:
+       min_ink: float; smallest fraction of dark pixels in a row of text
+       min_gap: int; blank rows shorter than this do not split a band
+       min_height: int; bands lower than this are dropped as noise
+
+    Return:
+       bands: list(tuple); (top, bottom) rows of each text line
+    """
+    profile = (img < 128).mean(axis=1)
+    if profile.ndim > 1:
+        profile = profile.mean(axis=1)
+    rows = np.flatnonzero(profile >= min_ink)
+    bands = []
+    if not len(rows):
+        return bands
+    top = bottom = rows[0]
+    for r in rows[1:]:
+        if r - bottom > min_gap:
+            bands.append((top, bottom+1))
+            top = r
+        bottom = r
+    bands.append((top, bottom+1))
+    return [(int(t), int(b)) for t, b in bands if b - t >= min_height]
+
+
+def regions(img, head=5, foot=15, min_ink=0.01, pad=8):
+    """
+    Header and footer regions of a preprocessed scan, where market, total,
+    date, and time usually are
+
+    Args:
+       img: np.ndarray; preprocessed grayscale image, dark text on white
+
+    Kwargs:
+       head: int; number of text lines in the header
+       foot: int; number of text lines in the footer
+       min_ink: float; smallest fraction of dark pixels in a row of text
+       pad: int; margin in rows around the regions
+
+    Return:
+       crops: list(np.ndarray); header and footer, empty if the scan does
+              not have more text lines than both together
+    """
+    bands = text_bands(img, min_ink=min_ink)
+    if len(bands) <= head + foot:
+        return []
+    height = img.shape[0]
+    crops = []
+    for first, last in ((bands[0], bands[head-1]), (bands[-foot], bands[-1])):
+        crops.append(img[max(0, first[0]-pad):min(height, last[1]+pad)])
+    return crops
+
+
+def recognizer(lang=LANGUAGES, dpi=DPI):
+    """
+    Text recognition of images in memory, by the process' tesserocr engine
+    if available, otherwise by the tesseract CLI on a temporary file
+
+    Args:
+       None
+
+    Kwargs:
+       lang: str; tesseract languages, e.g. 'deu+eng'
+       dpi: int; resolution of the images passed to the engine
+
+    Return:
+       recognize: callable; maps an image to its text lines
+    """
+    if tesserocr is not None:
+        return TesseractEngine.shared(lang, dpi).recognize
+
+    def recognize(img):
+        import cv2
+        tmpd = tempfile.mkdtemp(prefix="pentaplex-ocr-")
+        try:
+            src = os.path.join(tmpd, "region.png")
+            cv2.imwrite(src, img)
+            with io.open(tesseract(src, src[:-4]+".txt", lang=lang),
+                         encoding='utf-8') as f:
+                return f.read().splitlines()
+        finally:
+            shutil.rmtree(tmpd, ignore_errors=True)
+    return recognize
+
+
+class TesseractEngine(object):
+    """
+    Tesseract API instance with its language models loaded once per process,
+    recognizing text directly from NumPy arrays
+    """
+    _engines = {}
+
+    def __init__(self, lang=LANGUAGES, dpi=DPI):
+        """
+        Initializes the engine by loading the language models
+
+        Args:
+           None
+
+        Kwargs:
+           lang: str; tesseract languages, e.g. 'deu+eng'
+           dpi: int; resolution of the images passed to the engine
+        """
+        if tesserocr is None:
+            raise ImportError("The 'api' OCR engine requires tesserocr")
+        self.lang = lang
+        self.dpi = dpi
+        self.api = tesserocr.PyTessBaseAPI(lang=lang)
+
+    @classmethod
+    def shared(cls, lang=LANGUAGES, dpi=DPI):
+        """
+        Engine shared by all receipts of a (worker) process
+
+        Kwargs:
+           lang: str; tesseract languages, e.g. 'deu+eng'
+           dpi: int; resolution of the images passed to the engine
+
+        Return:
+           instance: TesseractEngine
+        """
+        if (lang, dpi) not in cls._engines:
+            cls._engines[(lang, dpi)] = cls(lang=lang, dpi=dpi)
+        return cls._engines[(lang, dpi)]
+
+    def recognize(self, img, words=False):
+        """
+        Recognize the text in an image
+
+        Args:
+           img: np.ndarray; preprocessed grayscale (uint8) image
+
+        Kwargs:
+           words: bool; also return the recognized words
+
+        Return:
+           lines: list(str); the recognized text lines
+           words: list(tuple); (word, confidence, (x1, y1, x2, y2)) of each
+                  word, only if words is True
+        """
+        # crops and trimmed scans are views with the stride of the full
+        # image; the bytes handed to tesseract must be packed row by row
+        img = np.ascontiguousarray(img, dtype=np.uint8)
+        height, width = img.shape[:2]
+        channels = 1 if img.ndim == 2 else img.shape[2]
+        self.api.SetImageBytes(img.tobytes(), width, height, channels,
+                               width*channels)
+        self.api.SetSourceResolution(self.dpi)
+        self.api.Recognize()
+        lines = self.api.GetUTF8Text().splitlines()
+        if not words:
+            return lines
+        level = tesserocr.RIL.WORD
+        found = []
+        for r in tesserocr.iterate_level(self.api.GetIterator(), level):
+            word = r.GetUTF8Text(level)
+            if word:
+                found.append((word, r.Confidence(level),
+                              r.BoundingBox(level)))
+        return lines, found
+
+
+if __name__ == "__main__":
+    tesseract(sys.argv[1], sys.argv[2])
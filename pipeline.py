@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+"""
+Staged receipt analysis: scanning, preprocessing, OCR, and parsing run in
+their own worker processes, connected by bounded queues
+
+@author: phdenzel
+
+"""
+import time
+import signal
+import traceback
+import threading
+import multiprocessing
+from receipt import Receipt
+from index import FileIndex
+from config import Config
+import metrics
+
+try:
+    # Python 3
+    from queue import Queue, Empty
+except ImportError:
+    # Python 2
+    from Queue import Queue, Empty
+
+# stages in order, each with its number of worker processes by default
+STAGES = ['scan', 'preprocess', 'ocr', 'parse']
+WORKERS = {'scan': 1, 'preprocess': 1, 'ocr': 2, 'parse': 1}
+# receipts waiting in front of each stage at most
+QUEUE_SIZE = 4
+
+
+def scan(job, options):
+    """
+    Hash the receipt's image and scan it, unless its text is cached
+    """
+    receipt = Receipt.staged(job['file_id'], job['image'], **options)
+    job['keys'] = receipt.cache_keys()
+    receipt.keys = job['keys']
+    if receipt.cache.lookup('txt', receipt.text_key()) is None:
+        receipt.run_scanner()
+    receipt.close()
+
+
+def preprocess(job, options):
+    """
+    Preprocess the receipt's scan, unless its text is cached; with retries
+    the variants are preprocessed by the OCR stage
+    """
+    receipt = Receipt.staged(job['file_id'], job['image'], keys=job['keys'],
+                             **options)
+    if receipt.retry is None and \
+       receipt.cache.lookup('txt', job['keys']['txt']) is None:
+        receipt.run_preprocessing()
+
+
+def ocr(job, options):
+    """
+    Recognize the text of the preprocessed scan, unless cached; with
+    retries of the preprocessing variants, cheapest first, until the
+    extraction is confident
+    """
+    receipt = Receipt.staged(job['file_id'], job['image'], keys=job['keys'],
+                             **options)
+    job['text'] = receipt.run_ocr()
+    job['lines'] = receipt.ocr_lines
+
+
+def parse(job, options):
+    """
+    Extract the receipt's info from its text
+    """
+    lines = job.get('lines')
+    if lines is None:
+        with metrics.stage('read'), open(job['text']) as f:
+            lines = f.readlines()
+        metrics.count_file('bytes_read', job['text'])
+    job['fields'] = Receipt.from_text(job['file_id'], lines).fields()
+    job['fields']['input'] = job['keys']['input']
+
+
+STEPS = {'scan': scan, 'preprocess': preprocess, 'ocr': ocr, 'parse': parse}
+
+
+def warm(stage, options):
+    """
+    Load what a stage's worker needs before its first receipt arrives: the
+    compiled config, and the tesseract language models of the OCR engine
+
+    Args:
+       stage: str; name of the stage, one of STAGES
+       options: dict; options of the run, see Receipt.staged
+
+    Kwargs:
+       None
+
+    Return:
+       None
+    """
+    if stage in ('ocr', 'parse'):
+        Config.load()
+    if stage == 'ocr' and options.get('ocr') in ('api', 'roi'):
+        from ocr import ENGINES, TesseractEngine, tesserocr
+        if tesserocr is not None:
+            params = ENGINES[options['ocr']]
+            TesseractEngine.shared(params['lang'], params['dpi'])
+
+
+def work(stage, inbox, outbox, options):
+    """
+    Worker loop of a stage, which passes every job on, failed or not,
+    until it receives None
+
+    Args:
+       stage: str; name of the stage, one of STAGES
+       inbox: multiprocessing.Queue; jobs for the stage
+       outbox: multiprocessing.Queue; jobs for the next stage
+       options: dict; options of the run, see Receipt.staged
+
+    Kwargs:
+       None
+
+    Return:
+       None
+    """
+    # interrupts are handled by the parent, which stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    warm(stage, options)
+    func = STEPS[stage]
+    while True:
+        job = inbox.get()
+        if job is None:
+            break
+        if 'error' not in job:
+            m = metrics.begin()
+            try:
+                func(job, options)
+            except (Exception, SystemExit):
+                job['error'] = traceback.format_exc()
+            job['metrics'] = metrics.merge(job.get('metrics'), m.as_dict())
+        outbox.put(job)
+
+
+def parse_workers(spec, jobs=None):
+    """
+    Worker counts of the stages from a specification string
+
+    Args:
+       spec: str; comma-separated counts, e.g. 'scan=2,ocr=4'
+
+    Kwargs:
+       jobs: int; default worker count of the OCR stage
+
+    Return:
+       workers: dict; worker count of each stage
+    """
+    workers = dict(WORKERS)
+    if jobs:
+        workers['ocr'] = jobs
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        stage, n = part.split("=")
+        stage = stage.strip()
+        if stage not in workers:
+            raise ValueError("Unknown stage {}, use one of {}".format(
+                stage, ", ".join(STAGES)))
+        workers[stage] = max(1, int(n))
+    return workers
+
+
+class Pipeline(object):
+    """
+    Worker processes for each stage, connected by bounded queues; a full
+    queue blocks the stage in front of it, so at most queue_size receipts
+    wait in front of each stage while the slowest stage stays saturated
+    """
+
+    def __init__(self, workers=None, queue_size=QUEUE_SIZE, **options):
+        """
+        Initializes the pipeline's settings
+
+        Args:
+           None
+
+        Kwargs:
+           workers: dict; worker count of each stage, defaults to WORKERS
+           queue_size: int; capacity of the queue in front of each stage
+           options: options of the run, e.g. preprocessing='native'
+        """
+        self.workers = dict(WORKERS, **(workers or {}))
+        self.queue_size = queue_size
+        self.options = options
+        self.queues = []
+        self.procs = []
+        self.pending = 0
+        self.backlog = None
+
+    def start(self):
+        """
+        Start the worker processes of all stages, once
+
+        Args/Kwargs:
+           None
+
+        Return:
+           self: Pipeline
+        """
+        if self.procs:
+            return self
+        self.queues = [multiprocessing.Queue(self.queue_size)
+                       for _ in range(len(STAGES)+1)]
+        for i, stage in enumerate(STAGES):
+            for _ in range(self.workers[stage]):
+                p = multiprocessing.Process(
+                    target=work, args=(stage, self.queues[i],
+                                       self.queues[i+1], self.options))
+                p.daemon = True
+                p.start()
+                self.procs.append(p)
+        # submitted jobs are fed by a thread, such that the consumer of the
+        # results never blocks on a full first queue
+        self.backlog = Queue()
+        feeder = threading.Thread(target=self.feed,
+                                  args=(iter(self.backlog.get, None),))
+        feeder.daemon = True
+        feeder.start()
+        return self
+
+    def put(self, job):
+        """
+        Put a job into the first queue, blocking while it is full
+        """
+        job['start'] = time.time()
+        self.queues[0].put(job)
+
+    def feed(self, jobs):
+        """
+        Put jobs into the first queue, blocking while it is full; runs in
+        the feeder thread until the backlog ends with None
+        """
+        for job in jobs:
+            self.put(job)
+
+    def submit(self, job):
+        """
+        Add a receipt to the running pipeline, without blocking
+
+        Args:
+           job: dict; 'file_id' and 'image' name of the receipt
+
+        Kwargs:
+           None
+
+        Return:
+           None
+        """
+        self.pending += 1
+        self.backlog.put(job)
+
+    def results(self, timeout=None):
+        """
+        Fields of the receipts finished by the pipeline
+
+        Args:
+           None
+
+        Kwargs:
+           timeout: float; seconds to wait for the next receipt, None waits
+                    until all submitted receipts are finished
+
+        Return:
+           results: generator(dict); fields of each receipt in order of
+                    completion, incl. their 'metrics'; failed receipts are
+                    reported and skipped
+        """
+        while self.pending:
+            try:
+                job = self.queues[-1].get(timeout=timeout or 1)
+            except Empty:
+                if not all(p.is_alive() for p in self.procs):
+                    raise RuntimeError("A pipeline worker died")
+                if timeout is None:
+                    continue
+                return
+            self.pending -= 1
+            if 'error' in job:
+                print("Receipt #{} failed:\n{}".format(
+                    job['file_id'], job['error']))
+                continue
+            stages = job['metrics']['stages']
+            cpu = sum(spent[1] for spent in stages.values())
+            stages['total'] = [time.time()-job['start'], cpu]
+            fields = job['fields']
+            fields['metrics'] = job['metrics']
+            yield fields
+
+    def stop(self):
+        """
+        Stop the worker processes; idle workers finish cleanly, receipts
+        still in flight are abandoned
+
+        Args/Kwargs/Return:
+           None
+        """
+        if self.backlog is not None:
+            self.backlog.put(None)
+            self.backlog = None
+        try:
+            if not self.pending:
+                for i, stage in enumerate(STAGES):
+                    for _ in range(self.workers[stage]):
+                        self.queues[i].put(None)
+                for p in self.procs:
+                    p.join()
+        finally:
+            for p in self.procs:
+                if p.is_alive():
+                    p.terminate()
+            self.procs = []
+            self.pending = 0
+
+    def run(self, jobs):
+        """
+        Run jobs through all stages
+
+        Args:
+           jobs: list(dict); 'file_id' and 'image' name of each receipt
+
+        Kwargs:
+           None
+
+        Return:
+           results: generator(dict); fields of each receipt in order of
+                    completion, incl. their 'metrics'; failed receipts are
+                    reported and skipped
+        """
+        self.start()
+        for job in jobs:
+            self.submit(job)
+        try:
+            for fields in self.results():
+                yield fields
+        finally:
+            self.stop()
+
+
+def run_pipeline(file_ids, workers=None, queue_size=QUEUE_SIZE, index=None,
+                 **options):
+    """
+    Analyze receipts in a staged pipeline
+
+    Args:
+       file_ids: list(str); file IDs of the receipts' images
+
+    Kwargs:
+       workers: dict; worker count of each stage, defaults to WORKERS
+       queue_size: int; capacity of the queue in front of each stage
+       index: FileIndex; index of the images, built if not given
+       options: options of the run, e.g. preprocessing='native', ocr='api',
+                debug=1
+
+    Return:
+       results: generator(dict); fields of each receipt in order of
+                completion
+    """
+    if index is None:
+        index = FileIndex()
+    jobs = [{'file_id': file_id, 'image': index.image(file_id)}
+            for file_id in file_ids]
+    return Pipeline(workers, queue_size, **options).run(jobs)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+@author: phdenzel
+
+Preprocess scans for OCR (clean, sharpen, and contrast)
+"""
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+import cv2
+
+# ImageMagick recipe to text clean a scan ({src} and {dst} are substituted)
+RECIPE = [
+    "convert", "-units", "PixelsPerInch", "-respect-parenthesis",
+    "(", "{src}", "-colorspace", "gray", "-type", "grayscale",
+    "-contrast-stretch", "0", ")",
+    "(", "-clone", "0", "-negate", "-lat", "30x30+5%", ")",
+    "-compose", "copy_opacity", "-composite", "-fill", "white",
+    "-opaque", "none", "-alpha", "off", "-background", "white",
+    "-deskew", "40%", "-sharpen", "0x4.0", "-white-threshold", "99.9%",
+    "-trim", "-density", "350", "+repage",
+    "{dst}",
+]
+
+# Native settings mirroring the ImageMagick recipe
+SETTINGS = {
+    'window': 31,       # -lat 30x30 (odd window size)
+    'offset': 0.05,     # -lat +5%
+    'max_skew': 15.,    # -deskew (largest correction in degrees)
+    'sharpen': 4.0,     # -sharpen 0x4.0
+    'white': 0.999,     # -white-threshold 99.9%
+}
+
+# Preprocessing parameters per method (part of the cache key)
+METHODS = {
+    'imagemagick': {'method': 'imagemagick', 'recipe': RECIPE},
+    'native': {'method': 'native', 'settings': SETTINGS},
+}
+
+# Variants to retry the OCR with, cheapest first (see Receipt.escalate):
+# the scanner's single-threshold binarizations (see scanner.thresholds),
+# then the methods
+VARIANTS = ['otsu', 'thresh_gauss', 'thresh_mean', 'thresh_binary',
+            'native', 'imagemagick']
+
+
+def imagemagick(src, dst, recipe=RECIPE):
+    """
+    Text clean a scan with ImageMagick's convert
+
+    Args:
+       src: str; path string to the scan
+       dst: str; path string to the preprocessed png
+
+    Kwargs:
+       recipe: list(str); the convert command line
+
+    Return:
+       dst: str; path string to the preprocessed png
+    """
+    cmd = [arg.format(src=src, dst=dst) for arg in recipe]
+    subprocess.check_call(cmd)
+    return dst
+
+
+def deskew(img, mask, max_skew=SETTINGS['max_skew']):
+    """
+    Rotate an image such that the text in mask is horizontal
+
+    Args:
+       img: np.ndarray; grayscale image on white background
+       mask: np.ndarray; binary mask of the text pixels
+
+    Kwargs:
+       max_skew: float; largest angle in degrees which is corrected
+
+    Return:
+       img: np.ndarray; the deskewed image
+    """
+    coords = np.column_stack(np.nonzero(mask)[::-1]).astype(np.float32)
+    if len(coords) < 5:
+        return img
+    angle = cv2.minAreaRect(coords)[-1]
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    if angle == 0 or abs(angle) > max_skew:
+        return img
+    h, w = img.shape[:2]
+    M = cv2.getRotationMatrix2D((w/2., h/2.), angle, 1.0)
+    return cv2.warpAffine(img, M, (w, h), flags=cv2.INTER_CUBIC,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+
+
+def trim(img):
+    """
+    Crop an image to the bounding box of its non-white pixels
+
+    Args:
+       img: np.ndarray; grayscale image on white background
+
+    Kwargs:
+       None
+
+    Return:
+       img: np.ndarray; the trimmed image
+    """
+    ys, xs = np.nonzero(img < 255)
+    if len(xs) == 0:
+        return img
+    return img[ys.min():ys.max()+1, xs.min():xs.max()+1]
+
+
+def native(dst, settings=SETTINGS):
+    """
+    Text clean a scan in-process with OpenCV, equivalent to the
+    ImageMagick recipe
+
+    Args:
+       dst: np.ndarray; the (grayscale) warped scan of a receipt
+
+    Kwargs:
+       settings: dict; native preprocessing settings
+
+    Return:
+       prepd: np.ndarray; binarized scan, black text on white
+    """
+    if dst.ndim == 3:
+        dst = cv2.cvtColor(dst, cv2.COLOR_BGR2GRAY)
+    # -contrast-stretch 0
+    gray = cv2.normalize(dst, None, 0, 255, cv2.NORM_MINMAX)
+    # -negate -lat 30x30+5%: text is darker than its local mean by 5%
+    mask = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                 cv2.THRESH_BINARY_INV, settings['window'],
+                                 255*settings['offset'])
+    # -compose copy_opacity ... -background white
+    clean = np.where(mask > 0, gray, 255).astype(np.uint8)
+    # -deskew
+    clean = deskew(clean, mask, max_skew=settings['max_skew'])
+    # -sharpen 0x4.0
+    blurred = cv2.GaussianBlur(clean, (0, 0), settings['sharpen'])
+    clean = cv2.addWeighted(clean, 1.5, blurred, -0.5, 0)
+    # -white-threshold 99.9% and binarization
+    clean[clean >= 255*settings['white']] = 255
+    _, prepd = cv2.threshold(clean, 0, 255,
+                             cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+    # -trim
+    return trim(prepd)
+
+
+def variant(name, scan):
+    """
+    Preprocess a scan with one of the VARIANTS
+
+    Args:
+       name: str; name of the variant
+       scan: str; path string to the warped scan
+
+    Kwargs:
+       None
+
+    Return:
+       prepd: np.ndarray; the preprocessed scan
+    """
+    if name == 'imagemagick':
+        tmpd = tempfile.mkdtemp(prefix="pentaplex-prp-")
+        try:
+            prepd = imagemagick(scan, os.path.join(tmpd, "prepd.png"))
+            return cv2.imread(prepd, cv2.IMREAD_GRAYSCALE)
+        finally:
+            shutil.rmtree(tmpd, ignore_errors=True)
+    dst = cv2.imread(scan, cv2.IMREAD_GRAYSCALE)
+    if name == 'native':
+        return native(dst)
+    from scanner import thresholds
+    return thresholds(dst)[name]
+
+
+if __name__ == "__main__":
+    # usage: preprocess.py SCAN PNG [imagemagick|native]
+    if sys.argv[3:] == ['native']:
+        cv2.imwrite(sys.argv[2], native(cv2.imread(sys.argv[1], 0)))
+    else:
+        imagemagick(sys.argv[1], sys.argv[2])
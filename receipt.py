@@ -6,9 +6,16 @@ A program to make sense of pentaplex's outputs for receipt analysis
 
 """
 import os
-import re
 from cv2 import imread
-from difflib import get_close_matches
+from difflib import get_close_matches, SequenceMatcher
+import layout
+from workspace import Workspace
+from cache import ArtifactCache, stage_keys
+from ingest import Ingested
+from index import FileIndex
+from config import Config
+from extract import Candidates
+import metrics
 
 try:
     # Python 3
@@ -24,14 +31,13 @@ class Receipt(object):
     """
     __version__ = '0.1'
 
-    root = "/".join(os.path.realpath(__file__).split("/")[:-1])+"/"
-    imgd = "".join([root, "imgs/"])
-    prpd = "".join([root, "prp/"])
-    txtd = "".join([root, "txt/"])
-    tmpd = "".join([root, "tmp/"])
+    # lowest score of every field for a confident extraction (see escalate)
+    threshold = 0.8
 
     def __init__(self, file_id, total=None, market=None, date=None, time=None,
-                 auto=False):
+                 auto=False, workspace=None, cache=None,
+                 preprocessing='imagemagick', ocr='cli', index=None,
+                 debug=0, retry=None):
         """
         Initializes a receipt by reading a file id
 
@@ -46,18 +52,42 @@ class Receipt(object):
            date:   str; the date when the receipt was received
            total:  str; the total amount payed
            auto:   bool; run scripts to scan and ocr a receipt
+           workspace: Workspace; scratch directory for the receipt's scan,
+                      defaults to tmp/<file_id>/
+           cache:  ArtifactCache; cache of the scan, preprocessing and OCR
+                   artifacts, defaults to the process-wide cache
+           preprocessing: str; either 'imagemagick' or 'native' (OpenCV)
+           ocr:    str; either 'cli' (tesseract), 'api' (tesserocr engine
+                   loaded once per process), or 'roi' (header and footer
+                   first, full page on demand)
+           index:  FileIndex; index of the images and artifacts by file ID,
+                   defaults to the process-wide index
+           debug:  int; scanner debug level of the intermediate products
+                   saved in the workspace (see scanner.DEBUG)
+           retry:  float; threshold below which the OCR is retried on other
+                   preprocessing variants (see escalate), None to not retry
         """
         self.auto = auto
+        self.workspace = workspace or Workspace(file_id)
+        self.cache = cache or ArtifactCache.default()
+        self.index = index or FileIndex.default()
+        self.keys = {}
+        self.preprocessing = preprocessing
+        self.ocr = ocr
+        self.debug = debug
+        self.retry = retry
+        self.scan_report = {}
+        self.ocr_lines = None
+        self.ocr_words = None
+        self._source = None
+        self._dst = None
+        self._matches = None
+        self._candidates = None
         self.files = {}
         self.file_id = file_id
         self.configs = Receipt.load_configs(self.files['config'])
         self.data = self.read_files(self.files)
-        self.text = self.clean_ocr(self.data['ocr_text'])
-        # extract important info
-        self.total = self.parse_total(total)
-        self.market = self.parse_market(market)
-        self.date = self.parse_date(date)
-        self.time = self.parse_time(time)
+        self.analyze(total=total, market=market, date=date, time=time)
 
     @classmethod
     def empty(cls):
@@ -69,6 +99,165 @@ class Receipt(object):
         """
         return cls(None)
 
+    @classmethod
+    def from_text(cls, file_id, lines, config_path=None, **kwargs):
+        """
+        Constructor for a receipt from its OCR text only, skipping all image
+        and file lookups (e.g. to re-analyze the txt/ archive)
+
+        Args:
+           file_id: str; the file ID of the receipt's image
+           lines: list(str); the raw OCR text lines
+
+        Kwargs:
+           config_path: str; path string to the yaml config file
+           market, date, total, time: str; arguments to overwrite results
+
+        Return:
+           instance: Receipt
+        """
+        receipt = cls.__new__(cls)
+        receipt._file_id = file_id
+        receipt.auto = False
+        receipt.image = None
+        receipt._source = None
+        receipt.ocr_lines = lines
+        receipt.ocr_words = None
+        receipt._matches = None
+        receipt._candidates = None
+        receipt.files = {'config': config_path or layout.config}
+        receipt.configs = cls.load_configs(receipt.files['config'])
+        receipt.data = {'ocr_text': lines}
+        receipt.analyze(**kwargs)
+        return receipt
+
+    @classmethod
+    def staged(cls, file_id, image, keys=None, cache=None,
+               preprocessing='imagemagick', ocr='cli', debug=0, retry=None,
+               **kwargs):
+        """
+        Constructor for a receipt handed between the stages of a pipeline,
+        skipping all lookups and the analysis (see pipeline)
+
+        Args:
+           file_id: str; the file ID of the receipt's image
+           image: str; name string of the receipt's image in imgs/
+
+        Kwargs:
+           keys: dict; cache keys computed by a previous stage
+           cache: ArtifactCache; cache of the artifacts, defaults to the
+                  process-wide cache
+           preprocessing: str; either 'imagemagick' or 'native'
+           ocr: str; either 'cli', 'api', or 'roi'
+           debug: int; scanner debug level of the intermediate products
+           retry: float; threshold below which the OCR is retried on other
+                  preprocessing variants (see escalate)
+           kwargs: other options of the run, ignored
+
+        Return:
+           instance: Receipt
+        """
+        receipt = cls.__new__(cls)
+        receipt._file_id = file_id
+        receipt.image = image
+        receipt.auto = False
+        receipt.workspace = Workspace(file_id)
+        receipt.cache = cache or ArtifactCache.default()
+        receipt.keys = dict(keys or {})
+        receipt.preprocessing = preprocessing
+        receipt.ocr = ocr
+        receipt.debug = debug
+        receipt.retry = retry
+        receipt.scan_report = {}
+        receipt.ocr_lines = None
+        receipt.ocr_words = None
+        receipt._source = None
+        receipt._dst = None
+        receipt._matches = None
+        receipt._candidates = None
+        return receipt
+
+    def analyze(self, total=None, market=None, date=None, time=None):
+        """
+        Clean the OCR text and extract the important info
+
+        Args:
+           None
+
+        Kwargs:
+           market, date, total, time: str; arguments to overwrite results
+
+        Return:
+           None
+        """
+        matcher = self.configs.matcher
+        comparisons = matcher.comparisons
+        with metrics.stage('parse'):
+            self.text = self.clean_ocr(self.data.get('ocr_text'))
+            self._matches = None
+            self._candidates = None
+            self.scores = {}
+            self.total = self.parse_total(total)
+            self.market = self.parse_market(market)
+            self.date = self.parse_date(date)
+            self.time = self.parse_time(time)
+        metrics.count('fuzzy_comparisons', matcher.comparisons-comparisons)
+
+    def fields(self):
+        """
+        Extracted info of the receipt
+
+        Args/Kwargs:
+           None
+
+        Return:
+           fields: dict; the receipt's file_id, market, total, date, time,
+                   confidence, the fields' scores, and the raw OCR lines
+        """
+        return {
+            'file_id': self.file_id,
+            'market': self.market,
+            'total': self.total,
+            'date': self.date,
+            'time': self.time,
+            'confidence': self.confidence(),
+            'scores': dict(self.scores),
+            'lines': [line.rstrip('\r\n')
+                      for line in self.data.get('ocr_text') or []],
+        }
+
+    def confidence(self):
+        """
+        Confidence of the extracted info, the mean of the fields' scores
+        (fuzzy match score of market and total, 1 for a found date or time)
+
+        Args/Kwargs:
+           None
+
+        Return:
+           confidence: float; between 0 (nothing found) and 1
+        """
+        fields = ('market', 'total', 'date', 'time')
+        return sum(self.scores.get(f, 0.) for f in fields)/len(fields)
+
+    def confident(self, threshold=None):
+        """
+        Check if all fields were found with a score of at least threshold
+
+        Args:
+           None
+
+        Kwargs:
+           threshold: float; lowest score, defaults to Receipt.threshold
+
+        Return:
+           confident: bool; True if no field needs another try
+        """
+        if threshold is None:
+            threshold = Receipt.threshold
+        fields = ('market', 'total', 'date', 'time')
+        return all(self.scores.get(f, 0.) >= threshold for f in fields)
+
     @property
     def file_id(self):
         """
@@ -120,42 +309,113 @@ class Receipt(object):
             print("Trying to run preprocessing and OCR...\n")
             self.run_ocr()
             self.auto = False
-        dst = self.check_scanner_id()
-        prepd, text = self.check_ocr_id()
+        if filetype in ArtifactCache.stages:
+            f = self.cache.latest(self.file_id, filetype)
+            if f:
+                return f
         # go through cases
         f = None
-        if filetype is 'scan':
-            f = Receipt.tmpd+dst
-        elif filetype is 'original':
-            f = Receipt.tmpd+"original.jpg"
-        elif filetype is 'preprocessed':
-            f = Receipt.prpd+prepd
-        elif filetype is 'txt':
-            f = Receipt.txtd+text
-        elif filetype is 'config':
-            f = Receipt.root+'config.yml'
+        if filetype == 'scan':
+            dst = self.check_scanner_id()
+            if self.index.scan(self.file_id):
+                f = layout.prpd+dst
+            else:
+                f = self.workspace.path+dst
+        elif filetype == 'original':
+            f = layout.imgd+self.image
+        elif filetype == 'preprocessed':
+            f = layout.prpd+self.check_ocr_id()[0]
+        elif filetype == 'txt':
+            f = layout.txtd+self.check_ocr_id()[1]
+        elif filetype == 'config':
+            f = layout.config
         return f
 
     def read_files(self, files):
         """
-        Read all files associated to the receipt
+        Read the text files associated to the receipt; images are only
+        decoded on demand through load_image
 
         Args/Kwargs:
            None
 
         Return:
-           data: dict; analogue keys to files
+           data: dict; analogue keys to files, 'ocr_text' is None if there
+                 is no OCR text
         """
-        data = {}
+        data = {'ocr_text': None}
         if files:
-            for k, i in files.iteritems():
-                if i.endswith('txt'):
-                    with open(i) as f:
+            for k, i in files.items():
+                if k == 'ocr_text' and self.ocr_lines is not None:
+                    # handed over in memory by the OCR engine
+                    data[k] = self.ocr_lines
+                elif i.endswith('txt'):
+                    with metrics.stage('read'), open(i) as f:
                         data[k] = f.readlines()
-                else:
-                    data[k] = imread(i)
+                    metrics.count_file('bytes_read', i)
         return data
 
+    def load_image(self, filetype):
+        """
+        Decode an image associated to the receipt (not kept in memory)
+
+        Args:
+           filetype: str; either 'original', 'scan', or 'preprocessed'
+
+        Kwargs:
+           None
+
+        Return:
+           img: np.ndarray; the decoded image, None if unavailable
+        """
+        if filetype == 'original' and self.image:
+            return self.source.decode()
+        path = self.files.get(filetype)
+        if path is None:
+            return None
+        return imread(path)
+
+    @property
+    def source(self):
+        """
+        The receipt's original image, memory-mapped on first access; its
+        bytes are hashed and decoded from the same buffer
+        """
+        if self._source is None or self._source.closed:
+            self._source = Ingested(layout.imgd+self.image)
+        return self._source
+
+    def close(self):
+        """
+        Unmap the receipt's original image
+
+        Args/Kwargs/Return:
+           None
+        """
+        if self._source is not None:
+            self._source.close()
+
+    @property
+    def original_img(self):
+        """
+        The receipt's original image, decoded on access
+        """
+        return self.load_image('original')
+
+    @property
+    def scan_img(self):
+        """
+        The receipt's warped scan, decoded on access
+        """
+        return self.load_image('scan')
+
+    @property
+    def preprocessed_img(self):
+        """
+        The receipt's preprocessed scan, decoded on access
+        """
+        return self.load_image('preprocessed')
+
     def clean_ocr(self, data):
         """
         Clean the output of the OCR
@@ -176,9 +436,30 @@ class Receipt(object):
                 text.append(clean_line)
         return text
 
-    def fuzzy_search(self, keyword, accuracy=0.6):
+    @property
+    def matches(self):
         """
-        Fuzzy search OCR output for a keyword and its possible value
+        Matches of the configured vocabulary in the cleaned OCR text,
+        computed in a single pass on first access
+        """
+        if self._matches is None:
+            self._matches = self.configs.matcher.match(self.text)
+        return self._matches
+
+    @property
+    def candidates(self):
+        """
+        Matches of the date, time, and total formats in the cleaned OCR
+        text, found in a single pass on first access
+        """
+        if self._candidates is None:
+            self._candidates = Candidates(
+                getattr(self.configs, 'fields_re', None), self.text)
+        return self._candidates
+
+    def fuzzy_line(self, keyword, accuracy=0.6):
+        """
+        Fuzzy search OCR output for the number of a keyword's line
 
         Args:
            keyword: str; a keywords after which is fuzzy searched
@@ -187,13 +468,58 @@ class Receipt(object):
            accuracy: float; accuracy parameter for the fuzzy search algorithm
 
         Return:
-           line: list(str); the line of the closest fuzzy search match
+           i: int; number of the line of the closest fuzzy search match
         """
-        for line in self.text:
+        matcher = getattr(self.configs, 'matcher', None)
+        if matcher is not None and keyword in matcher \
+           and accuracy >= matcher.cutoff:
+            return self.matches.locate(keyword, accuracy)[0]
+        for i, line in enumerate(self.text):
             words = line.split()
             is_match = get_close_matches(keyword, words, 1, accuracy)
             if is_match:
-                return line
+                return i
+
+    def fuzzy_search(self, keyword, accuracy=0.6):
+        """
+        Fuzzy search OCR output for a keyword and its possible value
+
+        Args:
+           keyword: str; a keywords after which is fuzzy searched
+
+        Kwargs:
+           accuracy: float; accuracy parameter for the fuzzy search algorithm
+
+        Return:
+           line: list(str); the line of the closest fuzzy search match
+        """
+        i = self.fuzzy_line(keyword, accuracy)
+        if i is not None:
+            return self.text[i]
+
+    def fuzzy_score(self, keyword, accuracy=0.6):
+        """
+        Score of the line found by fuzzy_search for a keyword
+
+        Args:
+           keyword: str; a keywords after which is fuzzy searched
+
+        Kwargs:
+           accuracy: float; accuracy parameter for the fuzzy search algorithm
+
+        Return:
+           score: float; similarity of the closest word in the matched line,
+                  0 if there is no match
+        """
+        matcher = getattr(self.configs, 'matcher', None)
+        if matcher is not None and keyword in matcher \
+           and accuracy >= matcher.cutoff:
+            return self.matches.find(keyword, accuracy)[1]
+        line = self.fuzzy_search(keyword, accuracy)
+        if not line:
+            return 0.
+        return max(SequenceMatcher(None, w, keyword).ratio()
+                   for w in line.split())
 
     def parse_total(self, total):
         """
@@ -209,16 +535,16 @@ class Receipt(object):
            total: str; matched total on the receipt
         """
         if total:
+            self.scores['total'] = 1.
             return total
         for total_key in self.configs.total_keys:
-            line = self.fuzzy_search(total_key)
-            if line:
-                # replace commas with dots to facilitate matching
-                line = line.replace(',', '.')
-                # parse the total
-                total_float = re.search(self.configs.total_format, line)
+            i = self.fuzzy_line(total_key)
+            if i is not None:
+                # the total on the key's line, with commas replaced by dots
+                total_float = self.candidates.on_line('total', i)
                 if total_float:
-                    return total_float.group()
+                    self.scores['total'] = self.fuzzy_score(total_key)
+                    return total_float.replace(',', '.')
 
     def parse_date(self, date):
         """
@@ -234,11 +560,12 @@ class Receipt(object):
            date: str; matched date on the receipt
         """
         if date:
+            self.scores['date'] = 1.
             return date
-        for line in self.text:
-            m = re.search(self.configs.date_format, line)
-            if m:
-                return m.group()
+        m = self.candidates.first('date')
+        if m:
+            self.scores['date'] = 1.
+            return m
 
     def parse_time(self, time):
         """
@@ -254,11 +581,12 @@ class Receipt(object):
            time: str; matched time on the receipt
         """
         if time:
+            self.scores['time'] = 1.
             return time
-        for line in self.text:
-            m = re.search(self.configs.time_format, line)
-            if m:
-                return m.group()
+        m = self.candidates.first('time')
+        if m:
+            self.scores['time'] = 1.
+            return m
 
     def parse_market(self, market):
         """
@@ -274,6 +602,7 @@ class Receipt(object):
            market: str; matched market
         """
         if market:
+            self.scores['market'] = 1.
             return market
         for int_accuracy in range(10, 6, -1):
             accuracy = int_accuracy/10.0
@@ -281,6 +610,8 @@ class Receipt(object):
                 for spelling in spellings:
                     line = self.fuzzy_search(spelling, accuracy)
                     if line:
+                        self.scores['market'] = self.fuzzy_score(spelling,
+                                                                 accuracy)
                         return market
 
     def check_img_id(self):
@@ -293,50 +624,35 @@ class Receipt(object):
         Return:
            image; str; name string of the original image in imgs/ matching id
         """
-        try:
-            if not any([self.file_id in i for i in os.listdir(Receipt.imgd)]):
-                print("File with ID {} not found".format(self.file_id))
-                raise FileNotFoundError
-            else:
-                image = [i for i in os.listdir(Receipt.imgd)
-                         if self.file_id in i][0]
-        except:
+        with metrics.stage('index'):
+            image = self.index.image(self.file_id)
+        if image is None:
+            print("File with ID {} not found".format(self.file_id))
             print("Try putting images into the pentaplex/imgs/ directory...")
             exit(1)
         return image
 
     def check_scanner_id(self):
         """
-        Check if file_id is found in prp/ or tmp/
+        Check if file_id is found in prp/ or the receipt's workspace
 
         Args/Kwargs:
            None
 
         Return:
-           dst: str; name string of the scanned image in prp/ or tmp/ matching
-                     file_id
-        """
-        try:  # first try
-            dst = [o for o in os.listdir(Receipt.prpd)
-                   if "dst_"+self.file_id in o][0]
-        except:
-            try:  # second try
-                print("Scan file ID not found in pentaplex/prp/...")
-                print("Trying pentaplex/tmpd/...")
-                dst = [o for o in os.listdir(Receipt.tmpd)
-                       if "dst_"+self.file_id in o][0]
-            except:
-                if self.auto:
-                    print("Trying to run image scan...\n")
-                    self.run_scanner()
-                    print("Trying to run preprocessing and OCR...\n")
-                    self.run_ocr()
-                    self.auto = False
-                    dst = [o for o in os.listdir(Receipt.prpd)
-                           if "dst_"+self.file_id in o][0]
-                else:
-                    print("Can't find the scanned image matching ID...")
-                    dst = " None found!"
+           dst: str; name string of the scanned image in prp/ or the workspace
+                     matching file_id
+        """
+        with metrics.stage('index'):
+            dst = self.index.scan(self.file_id)
+        if dst is None:
+            print("Scan file ID not found in pentaplex/prp/...")
+            print("Trying {}...".format(self.workspace.path))
+            if os.path.isfile(self.workspace.scan):
+                dst = os.path.basename(self.workspace.scan)
+            else:
+                print("Can't find the scanned image matching ID...")
+                dst = " None found!"
         return dst
 
     def check_ocr_id(self):
@@ -349,61 +665,298 @@ class Receipt(object):
         Return:
            prepd, text: str, str; name string of preprocessed and ocr txt files
         """
-        try:
-            prepid = [
-                o for o in os.listdir(Receipt.prpd)
-                if (self.file_id in o and "dst_" not in o)][0].split("_")[0]
-            prepd = [
-                o for o in os.listdir(Receipt.prpd)
-                if prepid+"." in o][0]
-            text = [
-                o for o in os.listdir(Receipt.txtd)
-                if prepid+"." in o][0]
-        except:
-            if self.auto:
-                print("Trying to run image scan...\n")
-                self.run_scanner()
-                print("Trying to run preprocessing and OCR...\n")
-                self.run_ocr()
-                prepid = [
-                    o for o in os.listdir(Receipt.prpd)
-                    if (self.file_id in o and "dst_" not in o)
-                ][0].split("_")[0]
-                prepd = [
-                    o for o in os.listdir(Receipt.prpd)
-                    if prepid+"." in o][0]
-                text = [
-                    o for o in os.listdir(Receipt.txtd)
-                    if prepid+"." in o][0]
-            else:
-                print("Can't find the OCR files matching ID...")
-                prepd = text = " None found!"
-        return prepd, text
+        with metrics.stage('index'):
+            found = self.index.ocr_files(self.file_id)
+        if found is None:
+            print("Can't find the OCR files matching ID...")
+            return " None found!", " None found!"
+        return found
+
+    def cache_keys(self):
+        """
+        Cache keys of the receipt's stages, from the hash of its image's bytes
+        and each stage's parameters
+
+        Args/Kwargs:
+           None
+
+        Return:
+           keys: dict; cache keys of 'input', 'scan', 'preprocessed', and 'txt'
+        """
+        import scanner
+        import preprocess
+        from ocr import ENGINES
+        with metrics.stage('hash'):
+            input_hash = self.source.digest
+        prep_params = preprocess.METHODS[self.preprocessing]
+        keys = stage_keys(input_hash, [('scan', scanner.SETTINGS),
+                                       ('preprocessed', prep_params),
+                                       ('txt', ENGINES[self.ocr])])
+        keys['input'] = input_hash
+        return keys
+
+    def variant_key(self, name):
+        """
+        Cache key of the OCR text of a preprocessing variant of the scan
+
+        Args:
+           name: str; name of the variant, one of preprocess.VARIANTS
+
+        Kwargs:
+           None
+
+        Return:
+           key: str; the text's cache key
+        """
+        from cache import digest
+        from preprocess import METHODS
+        from ocr import ENGINES
+        return digest(self.keys['scan'], name, METHODS.get(name),
+                      ENGINES[self.ocr])
+
+    def text_key(self):
+        """
+        Cache key of the receipt's first OCR text: of the cheapest variant
+        with retries, otherwise of the configured preprocessing
+        """
+        if self.retry is not None:
+            from preprocess import VARIANTS
+            return self.variant_key(VARIANTS[0])
+        return self.keys['txt']
 
     def run_scanner(self):
         """
-        Run the scanner.py script
+        Run the scanner in-process, unless the scan is already cached
 
-        Args/Kwargs/Return:
+        Args/Kwargs:
            None
+
+        Return:
+           scan: str; path string to the cached scan
+        """
+        import cv2
+        from shutil import copyfile
+        from scanner import scan
+        self.keys = self.cache_keys()
+        key = self.keys['scan']
+        path = self.cache.lookup('scan', key)
+        if path is None:
+            with metrics.stage('scan'):
+                # intermediate products are only kept for debugging, the
+                # scan itself is written to the cache directly
+                if self.debug:
+                    workspace = self.workspace.reset()
+                else:
+                    workspace = None
+                    self.workspace.remove()
+                self._dst = scan(self.source, workspace=workspace,
+                                 debug=self.debug, report=self.scan_report)
+                path = self.cache.prepare('scan', key)
+                if workspace is None:
+                    cv2.imwrite(path, self._dst)
+                else:
+                    copyfile(self.workspace.scan, path)
+            metrics.count_file('bytes_written', path)
+        else:
+            print("Already scanned: {}".format(path))
+        self.cache.record('scan', key, self.file_id, input=self.keys['input'])
+        return path
+
+    def run_preprocessing(self):
         """
-        import subprocess
-        cmd = "python " + Receipt.root + "scanner.py " \
-              + Receipt.imgd + self.image
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True)
-        print p.communicate()[0]
+        Run preprocessing on the scan, unless already cached
+
+        Args/Kwargs:
+           None
+
+        Return:
+           prepd: str; path string to the cached preprocessed image
+           img: np.ndarray; the preprocessed image if made in-process,
+                otherwise None
+        """
+        import cv2
+        from preprocess import imagemagick, native
+        scan = self.cache.lookup('scan', self.keys['scan'])
+        key = self.keys['preprocessed']
+        prepd = self.cache.lookup('preprocessed', key)
+        img = None
+        if prepd is None:
+            prepd = self.cache.prepare('preprocessed', key)
+            print("Preprocessing to {}".format(prepd))
+            with metrics.stage('preprocess'):
+                if self.preprocessing == 'native':
+                    # reuse the scan in memory if it was just made
+                    if self._dst is None:
+                        self._dst = cv2.imread(scan, cv2.IMREAD_GRAYSCALE)
+                        metrics.count_file('bytes_read', scan)
+                    img = native(self._dst)
+                    cv2.imwrite(prepd, img)
+                else:
+                    imagemagick(scan, prepd)
+                    metrics.count_file('bytes_read', scan)
+            metrics.count_file('bytes_written', prepd)
+        else:
+            print("Already preprocessed: {}".format(prepd))
+        self.cache.record('preprocessed', key, self.file_id,
+                          input=self.keys['input'])
+        self._dst = None
+        return prepd, img
 
     def run_ocr(self):
         """
-        Run the ocr.sh script
+        Run preprocessing and OCR on the scan, unless already cached;
+        the 'api' and 'roi' engines hand the text over in memory as
+        self.ocr_lines; with retries, the preprocessing variants are tried
+        cheapest first (see escalate), and the configured preprocessing
+        only if none of them recognized any text
 
-        Args/Kwargs/Return:
+        Args/Kwargs:
+           None
+
+        Return:
+           text: str; path string to the cached OCR text file
+        """
+        import cv2
+        from ocr import tesseract, write_text, TesseractEngine, ENGINES
+        if not self.keys:
+            self.keys = self.cache_keys()
+        if self.retry is not None:
+            text = self.escalate(self.retry)
+            if text is not None:
+                return text
+        key = self.keys['txt']
+        text = self.cache.lookup('txt', key)
+        if text is None:
+            prepd, img = self.run_preprocessing()
+            text = self.cache.prepare('txt', key)
+            with metrics.stage('ocr'):
+                if self.ocr in ('api', 'roi') and img is None:
+                    img = cv2.imread(prepd, cv2.IMREAD_GRAYSCALE)
+                    metrics.count_file('bytes_read', prepd)
+                if self.ocr == 'api':
+                    params = ENGINES['api']
+                    engine = TesseractEngine.shared(params['lang'],
+                                                    params['dpi'])
+                    self.ocr_lines, self.ocr_words = engine.recognize(
+                        img, words=True)
+                    write_text(self.ocr_lines, text)
+                elif self.ocr == 'roi':
+                    self.ocr_lines = self.roi_ocr(img, ENGINES['roi'])
+                    write_text(self.ocr_lines, text)
+                else:
+                    text = tesseract(prepd, text)
+                    metrics.count_file('bytes_read', prepd)
+            metrics.count_file('bytes_written', text)
+        else:
+            print("Already recognized: {}".format(text))
+        self.cache.record('txt', key, self.file_id, input=self.keys['input'])
+        return text
+
+    def escalate(self, threshold=None):
+        """
+        Recognize the preprocessing variants of the scan, cheapest first,
+        until all fields are confidently found; the best text is handed
+        over as self.ocr_lines and becomes the receipt's latest OCR text in
+        the cache; variants which fail are reported and skipped
+
+        Args:
            None
+
+        Kwargs:
+           threshold: float; lowest score of every field, defaults to
+                      Receipt.threshold
+
+        Return:
+           text: str; path string to the best cached OCR text, None if no
+                 variant could be recognized
+        """
+        from preprocess import VARIANTS, variant
+        from ocr import ENGINES, DPI, recognizer, write_text
+        if not self.keys:
+            self.keys = self.cache_keys()
+        scan = self.cache.lookup('scan', self.keys['scan'])
+        params = ENGINES[self.ocr]
+        best = None
+        for name in VARIANTS:
+            if best is not None and best[0].confident(threshold):
+                break
+            vkey = self.variant_key(name)
+            path = self.cache.lookup('txt', vkey)
+            if path is None:
+                if scan is None:
+                    continue
+                stage = 'ocr' if best is None else 'retry'
+                print("Running OCR with {} preprocessing".format(name))
+                if best is not None:
+                    metrics.count('retries')
+                try:
+                    with metrics.stage(stage):
+                        recognize = recognizer(params['lang'],
+                                               params.get('dpi', DPI))
+                        lines = recognize(variant(name, scan))
+                    path = write_text(lines, self.cache.prepare('txt', vkey))
+                except (Exception, SystemExit) as e:
+                    # a failed variant never costs the text found so far
+                    print("OCR with {} preprocessing failed: {}".format(
+                        name, e))
+                    metrics.count('retry_errors')
+                    continue
+            else:
+                with open(path) as f:
+                    lines = f.readlines()
+            self.cache.record('txt', vkey, self.file_id,
+                              input=self.keys['input'], variant=name)
+            candidate = Receipt.from_text(self.file_id, lines)
+            if best is None or self.better(candidate, best[0]):
+                best = candidate, lines, path, vkey
+        if best is None:
+            return None
+        self.cache.record('txt', best[3], self.file_id,
+                          input=self.keys['input'])
+        self.ocr_lines = best[1]
+        return best[2]
+
+    @staticmethod
+    def better(receipt, other):
+        """
+        Check if a receipt found more fields than another, or as many with
+        a higher confidence
+        """
+        def rank(r):
+            found = [r.market, r.total, r.date, r.time]
+            return len(found) - found.count(None), r.confidence()
+        return rank(receipt) > rank(other)
+
+    def roi_ocr(self, img, params):
         """
-        import subprocess
-        cmd = "bash "+Receipt.root+"ocr.sh"
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, shell=True)
-        print p.communicate()[0]
+        Recognize the header and footer regions of the preprocessed scan
+        first, and the whole scan only if a field is still missing
+
+        Args:
+           img: np.ndarray; the preprocessed scan
+           params: dict; parameters of the 'roi' engine (see ocr.ENGINES)
+
+        Kwargs:
+           None
+
+        Return:
+           lines: list(str); the recognized text lines
+        """
+        from ocr import recognizer, regions
+        recognize = recognizer(params['lang'], params['dpi'])
+        crops = regions(img, head=params['head'], foot=params['foot'],
+                        min_ink=params['min_ink'], pad=params['pad'])
+        if crops:
+            lines = []
+            for crop in crops:
+                lines += recognize(crop)
+            probe = Receipt.from_text(self.file_id, lines)
+            if None not in (probe.market, probe.total, probe.date,
+                            probe.time):
+                metrics.count('roi_ocr')
+                return lines
+        metrics.count('full_page_ocr')
+        return recognize(img)
 
     def print_properties(self):
         """
@@ -432,6 +985,7 @@ class Receipt(object):
     def load_configs(config_path):
         """
         Load a yaml config file and return a objectified dictionary
+        (parsed and compiled once per process, see config.Config)
 
         Args:
            config_path: str; path string to the yaml config file
@@ -440,15 +994,11 @@ class Receipt(object):
            None
 
         Return:
-           config: objectify instance; the read configurations
-        """
-        docs = {}
-        if config_path:
-            import yaml
-            from objectify import objectify
-            stream = open(config_path, "r")
-            docs = yaml.safe_load(stream)
-        return objectify(docs)
+           config: Config instance; the read configurations
+        """
+        if not config_path:
+            return Config({})
+        return Config.load(config_path)
 
 
 if __name__ == "__main__":
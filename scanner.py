@@ -7,40 +7,38 @@ Scanner transform for images of rectangular shapes
 # # Module imports
 import sys
 import os
-from shutil import rmtree
 import math
+import time
 import numpy as np
 import cv2
-from mkpath import mkdir_p
+import metrics
+from workspace import Workspace
+from ingest import Ingested, reduction
 VERBOSE = True
+# Debug level of the saved intermediate products:
+#   0: only the warped scan, 1: edge detection products, 2: all transforms
+DEBUG = 0
+
+# Edge detection and warp settings (part of the scan's cache key)
+SETTINGS = {
+    'size': 800,        # longest side of the edge detection's resolution
+    'kernel': 7,
+    'canny': [10, 250],
+    'candidates': 5,
+    'epsilons': [0.02, 0.05, 0.1],
+    'min_area': 0.1,    # smallest receipt area as fraction of the image
+    'reduced': False,   # decode JPEGs at a reduced resolution for detection
+}
 
-# # File import
-# Get image to work with
-filename = sys.argv[1]
-if os.getcwd() in filename:
-    filepath = filename
-    filename = filepath.split("/")[-1]
-else:
-    filepath = os.getcwd()+'/'+filename
-    filename = filepath.split("/")[-1]
-# just making sure...
 try:
     # Python 3
     FileNotFoundError
 except NameError:
     # Python 2
     FileNotFoundError = IOError
-try:
-    file(filepath)
-except FileNotFoundError:
-    print("No such file found...")
-    sys.exit(1)
+
 # get path of repository
 root = "/".join(os.path.realpath(__file__).split("/")[:-1])+"/"
-# verbosity
-if VERBOSE:
-    print("Repository in:\t\t{}".format(root))
-    print("Image file:\t\t{}".format(filename))
 
 
 def primary_transf(rgba, roundup=127, rounddown=127):
@@ -84,126 +82,289 @@ def rect_angle(h):
     return hrect
 
 
-# # Import image
-image = cv2.imread(filepath)
-width, height, channels = image.shape
-aspr = float(width)/height
-_width, _height = int(800*aspr), 800
-_width, _height = width, height
-# verbosity
-if VERBOSE:
-    print("Image dimensions:\t{}x{} in {} channels".format(
-        width, height, channels))
-
-# Resize image
-# adjust dimensions if important content is lost
-image = cv2.resize(image, (_width, _height))
-# verbosity
-if VERBOSE:
-    print("Resizing to {}x{}...".format(_width, _height))
-
-# Original
-orig = image.copy()
-
-# Some transforms
-contrast = primary_transf(image, roundup=177, rounddown=77)
-if VERBOSE:
-    print("Grayscaling...")
-gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-if VERBOSE:
-    print("Blurring...")
-blurred = cv2.bilateralFilter(gray, 1, 10, 120)
-blurred = cv2.GaussianBlur(blurred, (5, 5), 0)
-# blurred = cv2.medianBlur(gray, 15)
-if VERBOSE:
-    print("Running Canny edge detection...")
-kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (7, 7))
-dilated = cv2.dilate(blurred, kernel)
-edged = cv2.Canny(dilated, 10, 250)
-edged_orig = edged.copy()
-closed = cv2.morphologyEx(edged, cv2.MORPH_CLOSE, kernel)
-
-
-# Contours in edged image
-if VERBOSE:
-    print("Finding contours...")
-_, contours, h = cv2.findContours(
-    closed, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
-# _, contours, _ = cv2.findContours(
-#     dilated, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
-contours = sorted(contours, key=cv2.contourArea, reverse=True)[:5]
-# approximate contour
-if VERBOSE:
-    print("Filtering edge contours...")
-for c in contours[1:]:
-    p = cv2.arcLength(c, True)
-    approx = cv2.approxPolyDP(c, 0.1*p, True)
-    if len(approx) == 4:
-        # rect = cv2.minAreaRect(approx)
-        # box = cv2.boxPoints(rect)
-        # box = np.int0(box)
-        # target = box
-        target = approx
-        break
-
-# outline target contour
-cv2.drawContours(image, [target], -1, (0, 0, 255), 5)
-while False:
-    cv2.startWindowThread()
-    cv2.namedWindow("Is this the window you want?", cv2.WINDOW_NORMAL)
-    cv2.imshow("Is this the window you want?", image)
-    cv2.imshow("Is this the window you want?", image)
-    cv2.waitKey(0)
-
-
-# Mapping target points to 800x800 quadrilateral
-approx = rect_ify(target)
-if VERBOSE:
-    print("Transforming perspective...")
-
-# TODO: rotate if necessary
-
-dstw = 100 * int(math.ceil(0.005*(approx[1][0]+approx[2][0]
-                                  - approx[0][0]-approx[3][0])))
-dsth = 100 * int(math.ceil(0.005*(approx[2][1]+approx[3][1]
-                                  - approx[1][1]-approx[0][1])))
-pts2 = np.float32([[0, 0], [dstw, 0], [dstw, dsth], [0, dsth]])
-M = cv2.getPerspectiveTransform(approx, pts2)
-dst = cv2.warpPerspective(orig, M, (dstw, dsth))
-
-dst = cv2.cvtColor(dst, cv2.COLOR_BGR2GRAY)
-
-# Threshold warped image
-ret, th1 = cv2.threshold(dst, 127, 255, cv2.THRESH_BINARY)
-th2 = cv2.adaptiveThreshold(dst, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
-                            cv2.THRESH_BINARY, 11, 2)
-th3 = cv2.adaptiveThreshold(dst, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                            cv2.THRESH_BINARY, 11, 2)
-ret2, th4 = cv2.threshold(dst, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
-
-# verbosity
-if VERBOSE:
-    print("Thresholding warped images...")
-
-rmtree(root+"tmp")
-mkdir_p(root+"tmp/")
-imgid = filename.split('.')[0].split('_')[-1]
-
-cv2.imwrite(root+"tmp/dst_"+imgid+".jpg", dst)
-cv2.imwrite(root+"tmp/blurred.jpg", blurred)
-cv2.imwrite(root+"tmp/dilated.jpg", dilated)
-cv2.imwrite(root+"tmp/edged.jpg", edged_orig)
-cv2.imwrite(root+"tmp/gray.jpg", gray)
-cv2.imwrite(root+"tmp/original.jpg", orig)
-cv2.imwrite(root+"tmp/outline.jpg", image)
-cv2.imwrite(root+"tmp/primary.jpg", contrast)
-cv2.imwrite(root+"tmp/thresh_binary.jpg", th1)
-cv2.imwrite(root+"tmp/thresh_mean.jpg", th2)
-cv2.imwrite(root+"tmp/thresh_gauss.jpg", th3)
-cv2.imwrite(root+"tmp/otsu.jpg", th4)
-# verbosity
-if VERBOSE:
-    print("Saving transforms in tmp/ directory...")
+def resolve_path(filename):
+    """
+    Resolve an image file name relative to the current working directory
+
+    Args:
+       filename: str; path string to the image file
+
+    Kwargs:
+       None
+
+    Return:
+       filepath: str; absolute path string to the image file
+    """
+    if os.getcwd() in filename:
+        filepath = filename
+    else:
+        filepath = os.getcwd()+'/'+filename
+    return filepath
+
+
+def thresholds(dst):
+    """
+    Binarizations of a warped scan
+
+    Args:
+       dst: np.ndarray; the warped grayscale scan
+
+    Kwargs:
+       None
+
+    Return:
+       variants: dict; global, mean and gaussian adaptive, and Otsu
+                 thresholded scans
+    """
+    ret, th1 = cv2.threshold(dst, 127, 255, cv2.THRESH_BINARY)
+    th2 = cv2.adaptiveThreshold(dst, 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                cv2.THRESH_BINARY, 11, 2)
+    th3 = cv2.adaptiveThreshold(dst, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                cv2.THRESH_BINARY, 11, 2)
+    ret2, th4 = cv2.threshold(dst, 0, 255,
+                              cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+    return {
+        'thresh_binary': th1,
+        'thresh_mean': th2,
+        'thresh_gauss': th3,
+        'otsu': th4,
+    }
+
+
+def find_quad(edged, settings=SETTINGS, report=None):
+    """
+    Find the receipt's quadrilateral in an edge image; tries polygon
+    approximations of the largest contours with increasing epsilons, then
+    the minimal area rectangle of the largest contour, then the full frame
+
+    Args:
+       edged: np.ndarray; binary edge image
+
+    Kwargs:
+       settings: dict; edge detection and warp settings
+       report: dict; if given, filled with the 'strategy' which succeeded,
+               the number of 'contours' examined, and the wall 'seconds'
+               and 'cpu' seconds it took
+
+    Return:
+       quad: np.ndarray; the four corners of the receipt, shape (4, 1, 2)
+       strategy: str; 'approx', 'min_area_rect', or 'full_frame'
+    """
+    start, cpu = time.time(), metrics.cpu_time()
+    height, width = edged.shape[:2]
+    min_area = settings['min_area']*width*height
+    contours = cv2.findContours(
+        edged, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)[-2]
+    contours = sorted(contours, key=cv2.contourArea,
+                      reverse=True)[:settings['candidates']]
+    # the largest contour is usually the outer side of the receipt's edge
+    candidates = contours[1:] if len(contours) > 1 else contours
+    candidates = [c for c in candidates if cv2.contourArea(c) >= min_area]
+    quad, strategy, examined = None, None, 0
+    # approximate contour
+    for c in candidates:
+        examined += 1
+        p = cv2.arcLength(c, True)
+        for epsilon in settings['epsilons']:
+            approx = cv2.approxPolyDP(c, epsilon*p, True)
+            if len(approx) == 4 and cv2.isContourConvex(approx):
+                quad, strategy = approx, 'approx'
+                break
+        if quad is not None:
+            break
+    # fall back to the rotated bounding box of the largest contour
+    if quad is None and candidates:
+        box = cv2.boxPoints(cv2.minAreaRect(candidates[0]))
+        quad, strategy = box.reshape((4, 1, 2)), 'min_area_rect'
+    # fall back to the full frame
+    if quad is None:
+        quad = np.array([[0, 0], [width-1, 0], [width-1, height-1],
+                         [0, height-1]]).reshape((4, 1, 2))
+        strategy = 'full_frame'
+    metrics.count('contours', examined)
+    if report is not None:
+        report.update(strategy=strategy, contours=examined,
+                      seconds=time.time()-start, cpu=metrics.cpu_time()-cpu)
+    return quad.astype(np.int32), strategy
+
+
+def transforms(image, settings=SETTINGS, debug=DEBUG, verbose=VERBOSE,
+               report=None, preview=None):
+    """
+    Detect the receipt in an image and warp it into a top-down view
+
+    Args:
+       image: np.ndarray; BGR image of a receipt
+
+    Kwargs:
+       settings: dict; edge detection and warp settings
+       debug: int; debug level of the intermediate products (see DEBUG)
+       verbose: bool; print progress to stdout
+       report: dict; if given, filled with the quadrilateral search's
+               report (see find_quad), the receipt's full resolution
+               'corners', and [wall, cpu] seconds of the edge detection
+               ('detect', incl. the search) and of the 'warp'
+       preview: np.ndarray; the image decoded at a reduced resolution, at
+                least at the working resolution, to resize from instead
+
+    Return:
+       products: dict; the warped scan 'dst' and the intermediate
+                 transforms of the debug level
+    """
+    products = {}
+    report = {} if report is None else report
+    start, cpu = time.time(), metrics.cpu_time()
+    height, width, channels = image.shape
+    # working resolution for the edge detection
+    scale = min(1., float(settings['size'])/max(width, height))
+    _width, _height = int(round(scale*width)), int(round(scale*height))
+    # verbosity
+    if verbose:
+        print("Image dimensions:\t{}x{} in {} channels".format(
+            width, height, channels))
+
+    # Original in full resolution for the warp
+    orig = image
+
+    # Resize image for the edge detection
+    # adjust dimensions if important content is lost
+    if scale < 1:
+        image = cv2.resize(image if preview is None else preview,
+                           (_width, _height), interpolation=cv2.INTER_AREA)
+    elif debug >= 1:
+        image = image.copy()  # for the outline
+    # verbosity
+    if verbose:
+        print("Resizing to {}x{}...".format(_width, _height))
+
+    # Some transforms
+    if debug >= 2:
+        products['original'] = orig
+        products['primary'] = primary_transf(image, roundup=177,
+                                             rounddown=77)
+    if verbose:
+        print("Grayscaling...")
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    if verbose:
+        print("Blurring...")
+    blurred = cv2.bilateralFilter(gray, 1, 10, 120)
+    blurred = cv2.GaussianBlur(blurred, (5, 5), 0)
+    # blurred = cv2.medianBlur(gray, 15)
+    if verbose:
+        print("Running Canny edge detection...")
+    ksize = settings['kernel']
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (ksize, ksize))
+    dilated = cv2.dilate(blurred, kernel)
+    edged = cv2.Canny(dilated, *settings['canny'])
+    closed = cv2.morphologyEx(edged, cv2.MORPH_CLOSE, kernel)
+
+    # Contours in edged image
+    if verbose:
+        print("Finding contours...")
+    target, strategy = find_quad(closed, settings=settings, report=report)
+    report['detect'] = [time.time()-start, metrics.cpu_time()-cpu]
+    if verbose:
+        print("Found receipt by {} in {:.3f}s...".format(
+            strategy, report['seconds']))
+
+    if debug >= 1:
+        # outline target contour
+        cv2.drawContours(image, [target], -1, (0, 0, 255), 5)
+        products.update(gray=gray, blurred=blurred, dilated=dilated,
+                        edged=edged, outline=image)
+
+    # Mapping target points (in full resolution) to a rectangle
+    start, cpu = time.time(), metrics.cpu_time()
+    approx = (rect_ify(target) / scale).astype(np.float32)
+    report['corners'] = approx.tolist()
+    if verbose:
+        print("Transforming perspective...")
+
+    # TODO: rotate if necessary
+
+    dstw = 100 * int(math.ceil(0.005*(approx[1][0]+approx[2][0]
+                                      - approx[0][0]-approx[3][0])))
+    dsth = 100 * int(math.ceil(0.005*(approx[2][1]+approx[3][1]
+                                      - approx[1][1]-approx[0][1])))
+    pts2 = np.float32([[0, 0], [dstw, 0], [dstw, dsth], [0, dsth]])
+    M = cv2.getPerspectiveTransform(approx, pts2)
+    dst = cv2.warpPerspective(orig, M, (dstw, dsth))
+
+    dst = cv2.cvtColor(dst, cv2.COLOR_BGR2GRAY)
+    report['warp'] = [time.time()-start, metrics.cpu_time()-cpu]
+
+    products['dst'] = dst
+
+    # Threshold warped image
+    if debug >= 2:
+        # verbosity
+        if verbose:
+            print("Thresholding warped images...")
+        products.update(thresholds(dst))
+
+    return products
+
+
+def save_transforms(products, workspace, verbose=VERBOSE):
+    """
+    Save the scan and its intermediate transforms into a receipt's workspace
+
+    Args:
+       products: dict; output of transforms
+       workspace: Workspace; the receipt's scratch directory
+
+    Kwargs:
+       verbose: bool; print progress to stdout
+
+    Return:
+       None
+    """
+    workspace.create()
+    for name, img in products.items():
+        cv2.imwrite(workspace.product(name), img)
+        metrics.count_file('bytes_written', workspace.product(name))
+    # verbosity
+    if verbose:
+        print("Saving transforms in {}...".format(workspace.path))
+
+
+def scan(image, workspace=None, debug=DEBUG, verbose=VERBOSE, report=None):
+    """
+    Scan a receipt image in-process
+
+    Args:
+       image: np.ndarray, Ingested, or str; BGR image, memory-mapped image
+              file (see ingest), or path string to an image file
+
+    Kwargs:
+       workspace: Workspace; if given the transforms are saved into it
+       debug: int; debug level of the saved products (see DEBUG)
+       verbose: bool; print progress to stdout
+       report: dict; if given, filled with the quadrilateral search's
+               report (see find_quad)
+
+    Return:
+       dst: np.ndarray; the warped grayscale scan of the receipt
+    """
+    preview = None
+    if not isinstance(image, np.ndarray):
+        opened = not isinstance(image, Ingested)
+        source = Ingested(image) if opened else image
+        if verbose:
+            print("Image file:\t\t{}".format(source.path.split("/")[-1]))
+        image = source.decode()
+        if SETTINGS['reduced']:
+            factor = reduction(image.shape, SETTINGS['size'])
+            if factor > 1:
+                preview = source.decode(factor)
+        if opened:
+            source.close()
+    products = transforms(image, debug=debug, verbose=verbose,
+                          report=report, preview=preview)
+    if workspace is not None:
+        save_transforms(products, workspace, verbose=verbose)
+    return products['dst']
+
 
 # # Other thresholding methods
 # ret, thresh1 = cv2.threshold(dst, 127, 255, cv2.THRESH_BINARY)
@@ -216,3 +377,23 @@ if VERBOSE:
 # cv2.imwrite(root+"tmp/Thresh Trunch.jpg", thresh3)
 # cv2.imwrite(root+"tmp/Thresh TOZERO.jpg", thresh4)
 # cv2.imwrite(root+"tmp/Thresh TOZERO_INV.jpg", thresh5)
+
+
+if __name__ == "__main__":
+    # # File import
+    # Get image to work with
+    filepath = resolve_path(sys.argv[1])
+    filename = filepath.split("/")[-1]
+    # verbosity
+    if VERBOSE:
+        print("Repository in:\t\t{}".format(root))
+        print("Image file:\t\t{}".format(filename))
+    try:
+        image = Ingested(filepath)
+    except FileNotFoundError:
+        print("No such file found...")
+        sys.exit(1)
+    imgid = filename.split('.')[0].split('_')[-1]
+    debug = int(sys.argv[2]) if len(sys.argv) > 2 else DEBUG
+    scan(image, workspace=Workspace(imgid).reset(), debug=debug,
+         verbose=VERBOSE)
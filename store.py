@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+"""
+Queryable SQLite store of the extracted receipt fields, keyed by the hash
+of the receipt's image
+
+@author: phdenzel
+
+"""
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import datetime
+import layout
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS receipts (
+        input TEXT PRIMARY KEY,
+        file_id TEXT,
+        market TEXT,
+        date TEXT,
+        time TEXT,
+        total REAL,
+        confidence REAL,
+        scores TEXT,
+        lines TEXT,
+        version TEXT,
+        params TEXT,
+        updated REAL
+    )""",
+    "CREATE INDEX IF NOT EXISTS receipts_market ON receipts (market)",
+    "CREATE INDEX IF NOT EXISTS receipts_date ON receipts (date)",
+]
+COLUMNS = ['input', 'file_id', 'market', 'date', 'time', 'total',
+           'confidence', 'scores', 'lines', 'version', 'params', 'updated']
+
+# aggregation groups of the queries
+GROUPS = {
+    'market': "market",
+    'month': "substr(date, 1, 7)",
+    'year': "substr(date, 1, 4)",
+}
+
+
+def to_date(date):
+    """
+    ISO date of a parsed date, e.g. '19.08.2015' -> '2015-08-19'
+
+    Args:
+       date: str; the date as found on the receipt (day, month, year)
+
+    Kwargs:
+       None
+
+    Return:
+       date: str; ISO formatted date, None if it is not a valid date
+    """
+    parts = re.findall(r'\d+', date or "")
+    if len(parts) != 3:
+        return None
+    day, month, year = [int(p) for p in parts]
+    if year < 100:
+        year += 2000
+    try:
+        return datetime.date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+def to_time(clock):
+    """
+    Normalized time of a parsed time, e.g. '19:00'
+
+    Args:
+       clock: str; the time as found on the receipt
+
+    Kwargs:
+       None
+
+    Return:
+       time: str; HH:MM, None if it is not a valid time
+    """
+    parts = re.findall(r'\d+', clock or "")
+    if len(parts) != 2:
+        return None
+    hours, minutes = [int(p) for p in parts]
+    if hours > 23 or minutes > 59:
+        return None
+    return "{:02d}:{:02d}".format(hours, minutes)
+
+
+def to_total(total):
+    """
+    Amount of a parsed total, e.g. '12. 50' -> 12.5
+
+    Args:
+       total: str; the total as found on the receipt
+
+    Kwargs:
+       None
+
+    Return:
+       amount: float; the total, None if there are no digits
+    """
+    parts = re.findall(r'\d+', total or "")
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return float(parts[0])
+    return float("{}.{}".format("".join(parts[:-1]), parts[-1]))
+
+
+class ResultStore(object):
+    """
+    SQLite database of the receipts' typed fields, raw OCR text, scores,
+    and the version of the pipeline which extracted them; rows are
+    buffered and inserted in bulk transactions
+    """
+    batch = 500
+
+    def __init__(self, path=None, version=None, params=None):
+        """
+        Initializes the store by opening (and creating) the database
+
+        Args:
+           None
+
+        Kwargs:
+           path: str; path string to the database file
+           version: str; version of the pipeline, stored with every row
+           params: str; digest of the run parameters (see batch.run_params)
+        """
+        self.path = path or layout.db
+        self.version = version
+        self.params = params
+        self.pending = []
+        self.db = sqlite3.connect(self.path)
+        with self.db:
+            for statement in SCHEMA:
+                self.db.execute(statement)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, fields):
+        """
+        Add a receipt's results, inserted with the next bulk transaction;
+        receipts without the hash of their image cannot be keyed and are
+        skipped
+
+        Args:
+           fields: dict; output of Receipt.fields incl. the 'input' hash
+
+        Kwargs:
+           None
+
+        Return:
+           added: bool; False if the receipt was skipped
+        """
+        if not fields.get('input'):
+            return False
+        self.pending.append((
+            fields['input'],
+            fields.get('file_id'),
+            fields.get('market'),
+            to_date(fields.get('date')),
+            to_time(fields.get('time')),
+            to_total(fields.get('total')),
+            fields.get('confidence'),
+            json.dumps(fields.get('scores') or {}, sort_keys=True),
+            json.dumps(fields.get('lines') or []),
+            self.version,
+            self.params,
+            time.time(),
+        ))
+        if len(self.pending) >= self.batch:
+            self.flush()
+        return True
+
+    def flush(self):
+        """
+        Insert (or replace) all pending rows in a single transaction
+
+        Args/Kwargs/Return:
+           None
+        """
+        if not self.pending:
+            return
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO receipts ({}) VALUES ({})".format(
+                    ", ".join(COLUMNS), ", ".join("?"*len(COLUMNS))),
+                self.pending)
+        self.pending = []
+
+    def close(self):
+        """
+        Flush pending rows and close the database
+
+        Args/Kwargs/Return:
+           None
+        """
+        self.flush()
+        self.db.close()
+
+    def where(self, market=None, since=None, until=None):
+        """
+        SQL condition and parameters of the common query filters
+        """
+        clauses, params = [], []
+        if market is not None:
+            clauses.append("market = ?")
+            params.append(market)
+        if since is not None:
+            clauses.append("date >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("date <= ?")
+            params.append(until)
+        sql = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return sql, params
+
+    def spend(self, by=('market',), market=None, since=None, until=None):
+        """
+        Number of receipts and their spend, grouped
+
+        Args:
+           None
+
+        Kwargs:
+           by: tuple(str); groups, keys of GROUPS, e.g. ('market', 'month')
+           market: str; only receipts of this market
+           since: str; only receipts on or after this ISO date
+           until: str; only receipts on or before this ISO date
+
+        Return:
+           rows: list(tuple); the groups' values, count, and sum of totals
+        """
+        groups = ", ".join(GROUPS[g] for g in by)
+        sql, params = self.where(market, since, until)
+        self.flush()
+        return self.db.execute(
+            "SELECT {0}, COUNT(*), SUM(total) FROM receipts{1} "
+            "GROUP BY {0} ORDER BY {0}".format(groups, sql),
+            params).fetchall()
+
+    def receipts(self, market=None, since=None, until=None):
+        """
+        Typed fields of the stored receipts, ordered by date and time
+
+        Args:
+           None
+
+        Kwargs:
+           market: str; only receipts of this market
+           since: str; only receipts on or after this ISO date
+           until: str; only receipts on or before this ISO date
+
+        Return:
+           rows: list(dict); file_id, market, date, time, total, and
+                 confidence of each receipt
+        """
+        columns = ['file_id', 'market', 'date', 'time', 'total',
+                   'confidence']
+        sql, params = self.where(market, since, until)
+        self.flush()
+        cursor = self.db.execute(
+            "SELECT {} FROM receipts{} ORDER BY date, time".format(
+                ", ".join(columns), sql), params)
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def get(self, input_hash):
+        """
+        All stored columns of a receipt by the hash of its image
+
+        Args:
+           input_hash: str; hex digest of the receipt image's bytes
+
+        Kwargs:
+           None
+
+        Return:
+           row: dict; the receipt's columns with decoded scores and lines,
+                None if it is not stored
+        """
+        self.flush()
+        row = self.db.execute(
+            "SELECT {} FROM receipts WHERE input = ?".format(
+                ", ".join(COLUMNS)), (input_hash,)).fetchone()
+        if row is None:
+            return None
+        row = dict(zip(COLUMNS, row))
+        row['scores'] = json.loads(row['scores'])
+        row['lines'] = json.loads(row['lines'])
+        return row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Query the receipts stored by pentaplex --db")
+    parser.add_argument("query", choices=["spend", "receipts"],
+                        help="aggregate spend, or list the receipts")
+    parser.add_argument("--db", default=layout.db,
+                        help="path to the database")
+    parser.add_argument("--by", default="market",
+                        help="comma-separated groups of the spend: "
+                        "{}".format(", ".join(sorted(GROUPS))))
+    parser.add_argument("--market", default=None)
+    parser.add_argument("--since", default=None, help="ISO date")
+    parser.add_argument("--until", default=None, help="ISO date")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.db):
+        print("No database found at {}".format(args.db))
+        sys.exit(1)
+    filters = dict(market=args.market, since=args.since, until=args.until)
+    with ResultStore(args.db) as store:
+        if args.query == "spend":
+            by = [g.strip() for g in args.by.split(",")]
+            for g in by:
+                if g not in GROUPS:
+                    parser.error("unknown group {}".format(g))
+            for row in store.spend(by=by, **filters):
+                groups = " ".join("{!s:<20}".format(v) for v in row[:-2])
+                print("{}{:>8}{:>12.2f}".format(groups, row[-2],
+                                                row[-1] or 0))
+        else:
+            for r in store.receipts(**filters):
+                print("{!s:<12}{!s:<20}{!s:<12}{!s:<7}{!s:>10}".format(
+                    r['file_id'], r['market'], r['date'], r['time'],
+                    r['total']))
+
+
+if __name__ == "__main__":
+    main()
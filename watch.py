@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Watch-folder mode: poll imgs/ for new or changed receipt images and feed
+them into a running pipeline of warm workers
+
+@author: phdenzel
+
+"""
+import os
+import time
+import layout
+from index import image_id, listdir
+from journal import stat
+
+
+class Watcher(object):
+    """
+    Polls a directory for receipt images; a file is reported once its size
+    and modification time stayed the same over two polls, i.e. once it is
+    completely written, and again whenever it changes
+    """
+
+    def __init__(self, imgd=None, done=None):
+        """
+        Initializes the watcher; nothing is polled yet
+
+        Args:
+           None
+
+        Kwargs:
+           imgd: str; path string to the image directory, defaults to imgs/
+           done: callable; done(file_id, path) is True for images which were
+                 completed before, skipped when first seen
+        """
+        self.imgd = imgd or layout.imgd
+        self.done = done
+        self.seen = {}
+        self.pending = {}
+        self.paths = {}
+
+    def poll(self):
+        """
+        List the directory and collect the images which became stable since
+        the previous poll
+
+        Args/Kwargs:
+           None
+
+        Return:
+           jobs: list(dict); 'file_id' and 'image' name of each new or
+                 changed receipt
+        """
+        jobs = []
+        names = set(listdir(self.imgd))
+        for name in sorted(names):
+            path = os.path.join(self.imgd, name)
+            st = stat(path)
+            if st is None or not st[0]:
+                continue
+            if self.seen.get(name) == st:
+                self.pending.pop(name, None)
+                continue
+            if self.pending.get(name) != st:
+                # new or still being written, check again on the next poll
+                self.pending[name] = st
+                continue
+            del self.pending[name]
+            file_id = image_id(name)
+            first = name not in self.seen
+            self.seen[name] = st
+            self.paths[file_id] = path
+            if first and self.done is not None and self.done(file_id, path):
+                continue
+            jobs.append({'file_id': file_id, 'image': name})
+        # forget removed files, so they are processed if they reappear
+        for name in set(self.seen) - names:
+            del self.seen[name]
+        for name in set(self.pending) - names:
+            del self.pending[name]
+        return jobs
+
+
+def watch(watcher, pipeline, interval=0.5):
+    """
+    Process new or changed images as they appear, until interrupted
+
+    Args:
+       watcher: Watcher instance; the polled image directory
+       pipeline: pipeline.Pipeline instance; started once, its workers stay
+                 warm between receipts
+
+    Kwargs:
+       interval: float; seconds between polls
+
+    Return:
+       results: generator(dict); fields of each receipt in order of
+                completion, incl. their 'metrics'; the workers are stopped
+                when the generator is interrupted or closed
+    """
+    pipeline.start()
+    print("Watching {} (Ctrl-C to stop)".format(watcher.imgd))
+    try:
+        while True:
+            for job in watcher.poll():
+                pipeline.submit(job)
+            if pipeline.pending:
+                for fields in pipeline.results(timeout=interval):
+                    yield fields
+            else:
+                time.sleep(interval)
+    finally:
+        pipeline.stop()
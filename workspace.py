@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Isolated scratch directories for receipts in flight
+
+@author: phdenzel
+
+"""
+from shutil import rmtree
+from mkpath import mkdir_p
+import layout
+
+
+class Workspace(object):
+    """
+    Scratch directory tmp/<file_id>/ holding the intermediate products of
+    a single receipt, passed between the scan, preprocessing and OCR stages
+    """
+    def __init__(self, file_id, tmpd=None):
+        """
+        Initializes a workspace for a receipt's file id
+
+        Args:
+           file_id: str; the file ID unique to each picture of a receipt
+
+        Kwargs:
+           tmpd: str; parent directory of all workspaces, defaults to tmp/
+        """
+        self.file_id = file_id
+        self.path = "".join([tmpd or layout.tmpd, str(file_id), "/"])
+
+    def __repr__(self):
+        return "Workspace({!r})".format(self.path)
+
+    @property
+    def scan(self):
+        """
+        Path to the warped scan of the receipt
+        """
+        return "".join([self.path, "dst_", str(self.file_id), ".jpg"])
+
+    def product(self, name):
+        """
+        Path to an intermediate product in the workspace
+
+        Args:
+           name: str; name of the product, e.g. 'edged'
+
+        Kwargs:
+           None
+
+        Return:
+           path: str; path string to the product's jpg file
+        """
+        if name == 'dst':
+            return self.scan
+        return "".join([self.path, name, ".jpg"])
+
+    def create(self):
+        """
+        Create the workspace directory if it does not exist yet
+
+        Args/Kwargs:
+           None
+
+        Return:
+           self: Workspace
+        """
+        mkdir_p(self.path)
+        return self
+
+    def reset(self):
+        """
+        Remove stale products of a previous run and recreate the workspace
+
+        Args/Kwargs:
+           None
+
+        Return:
+           self: Workspace
+        """
+        self.remove()
+        return self.create()
+
+    def remove(self):
+        """
+        Remove the workspace and all its products
+
+        Args/Kwargs/Return:
+           None
+        """
+        rmtree(self.path, ignore_errors=True)
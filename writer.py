@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Stream the results of a receipt analysis into CSV or JSON lines files
+
+@author: phdenzel
+
+"""
+import sys
+import csv
+import json
+
+COLUMNS = ['id', 'market', 'date', 'time', 'total', 'confidence']
+
+
+def row(fields):
+    """
+    Fixed-column record of a receipt's extracted info
+
+    Args:
+       fields: dict; output of Receipt.fields
+
+    Kwargs:
+       None
+
+    Return:
+       record: dict; the receipt's info keyed by COLUMNS
+    """
+    record = dict((c, fields.get(c)) for c in COLUMNS)
+    record['id'] = fields.get('file_id')
+    return record
+
+
+class ResultWriter(object):
+    """
+    Base class of the writers, which append and flush one receipt at a time
+    """
+
+    def __init__(self, path, append=False):
+        """
+        Initializes the writer by opening the output file
+
+        Args:
+           path: str; path string to the output file
+
+        Kwargs:
+           append: bool; append to an existing file instead of overwriting
+        """
+        self.path = path
+        self.count = 0
+        mode = 'a' if append else 'w'
+        if sys.version_info[0] < 3:
+            self.f = open(path, mode+'b')
+        else:
+            self.f = open(path, mode, newline='')
+        self.empty = self.f.tell() == 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, fields):
+        """
+        Write a receipt's info and flush it to disk
+
+        Args:
+           fields: dict; output of Receipt.fields
+
+        Kwargs:
+           None
+
+        Return:
+           None
+        """
+        self._write(row(fields))
+        self.f.flush()
+        self.count += 1
+
+    def _write(self, record):
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Close the output file
+
+        Args/Kwargs/Return:
+           None
+        """
+        self.f.close()
+
+
+class CSVWriter(ResultWriter):
+    """
+    One quoted CSV row per receipt, after a header row
+    """
+
+    def __init__(self, path, append=False):
+        super(CSVWriter, self).__init__(path, append=append)
+        self.w = csv.DictWriter(self.f, COLUMNS, quoting=csv.QUOTE_ALL)
+        if self.empty:
+            self.w.writeheader()
+
+    def _write(self, record):
+        self.w.writerow(record)
+
+
+class JSONLWriter(ResultWriter):
+    """
+    One JSON object per line and receipt
+    """
+
+    def _write(self, record):
+        self.f.write(json.dumps(record, sort_keys=True)+'\n')
+
+
+WRITERS = {
+    'csv': CSVWriter,
+    'jsonl': JSONLWriter,
+}
+
+
+def open_writer(path, fmt='csv', append=False):
+    """
+    Open a writer for the results of a receipt analysis
+
+    Args:
+       path: str; path string to the output file
+
+    Kwargs:
+       fmt: str; either 'csv' or 'jsonl'
+       append: bool; append to an existing file instead of overwriting
+
+    Return:
+       writer: ResultWriter instance
+    """
+    return WRITERS[fmt](path, append=append)